@@ -1,41 +1,132 @@
+import time
+PROCESS_START = time.monotonic()  # Referencia para medir el tiempo hasta el primer frame
+
+import argparse
+import signal
 import socket
-import cv2
-import socket
-import cv2
-import numpy as np
+import sys
 import threading
-import pystray
-import ctypes
-import time
 import json
 import logging
-from flask import Response, Flask, request
-import tkinter as tk
-from tkinter import ttk
-from tkinter import messagebox
-from PIL import Image, ImageDraw
-
-import wmi  # Import the wmi module
-
-# Configuración del logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-frame_buffer = None
+import os
+import multiprocessing
+
+from async_server import AsyncStreamServer
+from capture import CaptureStage
+from clients import ClientRegistry, QualityController, ViewerReports
+from devices import DeviceRegistry, SYSFS_VIDEO_ROOT
+from metrics import MetricsRegistry
+from logs import LOG_FORMAT, ClientLogLimiter, setup_logging
+from fmp4 import Fmp4Stream, FragmentCursor, find_ffmpeg
+from hub import multipart_chunks
+from pipeline import ChangeDetector, EncodePipeline, EncodePool
+from relay import RelayStage, check_relay_url, relay_url
+from recorder import ReplayClock, SegmentRecorder, parse_replay_start
+from renditions import RenditionSet
+from shm_ring import SharedFrameRing, capture_worker
+from sources import CameraSource, make_source
+from tiles import TileStream
+
+# Configuración inicial del logging; main() la reemplaza por la cola de setup_logging()
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+renditions = None  # Variantes (ancho, calidad) codificadas una vez por frame para todos los clientes
+encode_pipeline = None  # Etapa de codificación JPEG en paralelo
+tile_stream = None  # Streaming por tiles (sólo se codifican los tiles que cambian) para /tiles
+encode_pool = None  # Encoders compartidos por todas las fuentes
+source_renditions = {}  # id de fuente -> RenditionSet, para /video/<id>
+capture_stages = {}  # id de fuente -> CaptureStage o RelayStage con su propio hilo
+mp4_stream = None  # H.264 en MP4 fragmentado para /video.mp4 (necesita ffmpeg)
+recorder = None  # Grabación en disco (DVR) de los JPEG de la variante por defecto, para /replay
 streaming = False
 tray_icon = None
-frame_count = 0
+capture_stage = None  # CaptureStage de la fuente principal (/video)
 root = None
-client_delays = {}  # Diccionario para almacenar los retrasos de cada cliente
+metrics = MetricsRegistry()  # Contadores e histogramas expuestos en /metrics
+client_registry = ClientRegistry(metrics)  # Contabilidad de envío de cada cliente conectado a /video
+viewer_reports = ViewerReports(metrics)  # FPS decodificados y descartes que informa cada navegador por /report
 STATS_UPDATE_INTERVAL = 5000  # Intervalo de actualización de estadísticas en ms
+DEVICE_REFRESH_INTERVAL = 5.0  # Segundos entre refrescos en segundo plano de la lista de cámaras
+EXTRA_SOURCES = [("Pantalla completa", "screen:1"), ("Patrón de prueba", "synthetic:1280x720@30")]  # Fuentes además de las cámaras
 HEARTBEAT_INTERVAL = 10000  # Intervalo de heartbeat en ms
-DELAY_LOG_INTERVAL = 2  # Intervalo mínimo entre logs de retraso (en segundos)
+DELAY_LOG_INTERVAL = 2  # Intervalo mínimo entre logs de retraso de un mismo cliente (en segundos)
+DELAY_LOG_THRESHOLD = 200  # Latencia (ms) a partir de la cual se loguea el retraso de un cliente
+CLIENT_LOG_RATE = 0.5  # Logs por segundo que acepta /log y /report de cada cliente, pasada la ráfaga inicial
+CLIENT_LOG_BURST = 10  # Logs seguidos que puede enviar un cliente antes de que se aplique el límite
+MAX_CLIENT_LOG_LENGTH = 1000  # Caracteres de un log del navegador que se escriben
+JPEG_QUALITY = 30  # Calidad JPEG de la transmisión
+ENCODER_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # Hilos codificadores JPEG
+ENCODE_QUEUE_SIZE = ENCODER_WORKERS * 2  # Frames crudos en espera de codificación antes de descartar el más viejo
+CHANGE_DETECTION = True  # No codificar ni reenviar frames sin cambios
+CHANGE_PIXEL_THRESHOLD = 20  # Diferencia mínima (0-255) para considerar que un píxel cambió
+CHANGE_AREA_THRESHOLD = 0.002  # Fracción mínima de píxeles cambiados para considerar que el frame cambió
+KEEPALIVE_INTERVAL = 1.0  # Segundos entre reenvíos del último frame cuando la escena está quieta
+RENDITION_IDLE_TIMEOUT = 10.0  # Segundos sin suscriptores antes de eliminar una variante
+MAX_RENDITIONS = 8  # Máximo de variantes simultáneas; los pedidos extra reciben la variante por defecto
+MAX_CLIENT_BUFFER = 256 * 1024  # Bytes pendientes por cliente (modo async) antes de esperar a que el socket drene
+TILE_SIZE = 64  # Lado en píxeles de cada tile del streaming por tiles
+TILE_QUALITY = 50  # Calidad JPEG de cada tile
+TILE_PIXEL_THRESHOLD = 12  # Diferencia mínima (0-255) para considerar que un píxel de un tile cambió
+TILE_KEYFRAME_INTERVAL = 5.0  # Segundos entre recodificaciones completas de todos los tiles
+ADAPTIVE_TARGET_FPS = 15  # FPS objetivo del control adaptativo de calidad (/video?adaptive=1)
+ADAPTIVE_MAX_LATENCY = 500  # Latencia (ms) a partir de la cual el control adaptativo baja la calidad
+CAPTURE_MODES = ('thread', 'process')  # Captura y codificación en un hilo de este proceso o en un proceso aparte
+LOW_LATENCY_CAPTURE = True  # Vaciar el buffer de la cámara y leer el frame más reciente recién cuando hay un encoder libre
+SOURCE_IDLE_TIMEOUT = 10.0  # Segundos sin clientes tras los que se libera una fuente hasta que alguien la mire
+SOURCE_CHECK_TIMEOUT = 10.0  # Segundos para abrir la fuente principal y leer su primer frame antes de darla por no disponible
+RELAY_RETRY_INTERVAL = 0.5  # Espera inicial antes de reconectar a una instancia upstream; se duplica en cada fallo
+RELAY_MAX_RETRY_INTERVAL = 10.0  # Espera máxima entre reintentos de conexión al upstream
+FMP4_FPS = 15  # Frames por segundo del stream H.264
+FMP4_BITRATE = '800k'  # Bitrate del stream H.264; mucho menor que el MJPEG para enlaces congestionados
+FMP4_GOP = 1.0  # Segundos entre keyframes: lo que espera como máximo un cliente nuevo para empezar
+RECORD_DIRECTORY = None  # Carpeta donde grabar los últimos minutos para /replay; None = sin grabación
+RECORD_SEGMENT_SIZE = 64 * 1024 * 1024  # Bytes de JPEG por archivo de segmento
+RECORD_QUOTA = 1024 * 1024 * 1024  # Espacio máximo en disco de la grabación; se borran los segmentos más viejos
+RING_SLOTS = 8  # Frames que guarda el anillo de memoria compartida del modo 'process'
+RING_SLOT_SIZE = 2 * 1024 * 1024  # Tamaño máximo (bytes) de un JPEG en el anillo
+RING_POLL_INTERVAL = 0.002  # Segundos entre consultas a un anillo ajeno (--attach-ring), que no avisa de frames nuevos
+SERVER_MODES = ('flask', 'async')  # Servidor Werkzeug (un hilo por cliente) o asyncio (un único event loop)
+TTFF_BUDGET = 2.0  # Presupuesto (s) desde que arranca el proceso hasta el primer frame capturado
+MAX_REPORT_LOGS = 20  # Logs del navegador aceptados por informe
+FRAME_WAIT_TIMEOUT = 1.0  # Tiempo máximo que un cliente espera un frame nuevo antes de revisar el estado (en segundos)
+
+# Códigos de salida del modo headless
+EXIT_OK = 0
+EXIT_USAGE = 2
+EXIT_PORT_IN_USE = 3
+EXIT_SOURCE_UNAVAILABLE = 4
+EXIT_CAPTURE_ERROR = 5
+
+time_to_first_frame = None  # Segundos desde el arranque hasta el primer frame capturado
+
+client_log_limiter = ClientLogLimiter(CLIENT_LOG_RATE, CLIENT_LOG_BURST)  # Límite de logs por navegador
+
+device_registry = DeviceRegistry(SYSFS_VIDEO_ROOT, refresh_interval=DEVICE_REFRESH_INTERVAL)  # Cámaras disponibles, en caché
 
 def is_port_available(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('localhost', port)) != 0
 
+def show_error(message):
+    # En modo headless los errores sólo van al log; con la interfaz también se muestran en un diálogo
+    logging.error(message)
+    if root is not None:
+        from tkinter import messagebox
+        messagebox.showerror("Error", message)
+
+def show_info(message):
+    logging.info(message)
+    if root is not None:
+        from tkinter import messagebox
+        messagebox.showinfo("Éxito", message)
+
 def create_tray_icon(color):
     global tray_icon, root
+    if root is None:
+        return  # Modo headless: sin ícono de bandeja
+    import pystray
+    from PIL import Image, ImageDraw
+
     image = Image.new('RGB', (64, 64), color)
     draw = ImageDraw.Draw(image)
     draw.ellipse((10, 10, 54, 54), fill=color)
@@ -55,394 +146,1256 @@ def create_tray_icon(color):
 def on_exit():
     global root, tray_icon, streaming
     streaming = False
+    if renditions is not None:
+        renditions.close()
+    for stage in capture_stages.values():
+        stage.renditions.close()
+    if tile_stream is not None:
+        tile_stream.close()
+    if mp4_stream is not None:
+        mp4_stream.close()
     if tray_icon:
         tray_icon.stop()
     if root:
         root.destroy()
 
+def stop_on_signal(signum, frame):
+    global streaming
+    # El handler corre en el hilo principal, que puede estar dentro de un lock que on_exit() volvería a
+    # tomar: sólo se marca el fin y el bucle de captura hace la limpieza al salir
+    streaming = False
+
 def hide_window():
     global root
     root.withdraw()
 
 def list_cameras():
-    arr = []
-    try:
-        c = wmi.WMI()
-        for device in c.Win32_PnPEntity():
-            if device.Name and ("camera" in device.Name.lower() or "video" in device.Name.lower()):
-                name = device.Name
-                arr.append({"name": name, "index": len(arr)})  # Assign a unique index
-    except Exception as e:
-        logging.error(f"Error listing cameras with WMI: {e}")
-        # Fallback to the previous method if WMI fails
-        index = 0
-        while True:
-            cap = cv2.VideoCapture(index)
-            if not cap.isOpened():
-                break
-            else:
-                name = f"Cámara {index}"
-                arr.append({"name": name, "index": index})
-            cap.release()
-            index += 1
-
-    # Additional check for virtual cameras
-    for index in range(10):
-        cap = cv2.VideoCapture(index)
-        if cap.isOpened():
-            name = f"Virtual Camera {index}"
-            arr.append({"name": name, "index": index})
-            cap.release()
-
-    return arr
-
-last_delay_log_time = {}  # Diccionario para almacenar el último tiempo de log por cliente
-
-def start_server(port, camera_index):
-    global app, frame_buffer, streaming, frame_count, root, client_delays, last_delay_log_time
+    # Lista en caché del registro de dispositivos: no se vuelve a enumerar ni a abrir cámaras en cada llamada
+    return [{"name": device.name, "index": device.index, "id": device.id} for device in device_registry.devices()]
 
-    if not is_port_available(port):
-        messagebox.showerror("Error", f"El puerto {port} ya está en uso. Prueba con otro.")
-        return  
+def source_options():
+    # Cámaras detectadas más las fuentes que no dependen de un dispositivo (pantalla, patrón de prueba)
+    return [(cam["name"], cam["index"]) for cam in list_cameras()] + EXTRA_SOURCES
 
-    # Ensure the camera index is valid
-    cameras = list_cameras()
-    if camera_index >= len(cameras) or camera_index < 0:
-        messagebox.showerror("Error", f"Índice de cámara {camera_index} fuera de rango.")
+def record_client_delay(client):
+    # Se llama después de cada frame: el throttling usa el estado del propio cliente, sin locks ni diccionarios
+    # compartidos, y el log sólo encola el registro. La latencia va desde la captura hasta terminar de enviarlo
+    if client.latency <= DELAY_LOG_THRESHOLD:
         return
-
-    # Check if the camera is available before starting the server
-    cap = cv2.VideoCapture(camera_index)
-    if not cap.isOpened():
-        messagebox.showerror("Error", "La cámara no se pudo abrir. Puede que esté en uso por otra aplicación.")
-        if cap is not None:
-            cap.release()
+    now = time.monotonic()
+    if client.last_delay_log is None or now - client.last_delay_log >= DELAY_LOG_INTERVAL:
+        client.last_delay_log = now
+        logging.info(f"Client {client.ip} delay: {client.latency:.2f} ms, frames descartados: {client.drops}",
+                     extra={'client': client.ip, 'latency_ms': round(client.latency, 1), 'drops': client.drops})
+
+def quality_controller(renditions, args):
+    # Control adaptativo sólo si el cliente lo pide y no fijó ancho/calidad explícitos
+    if args.get('adaptive') not in ('1', 'true') or args.get('w') or args.get('q'):
+        return None
+    if renditions.max_renditions <= 1:
+        return None  # Relay o anillo compartido: sólo existe la variante por defecto
+    return QualityController(start=renditions.default_key, target_fps=ADAPTIVE_TARGET_FPS,
+                             max_latency=ADAPTIVE_MAX_LATENCY)
+
+def stream_stats():
+    stats = {'clients': client_registry.snapshot(), 'viewers': viewer_reports.snapshot()}
+    if time_to_first_frame is not None:
+        stats['time_to_first_frame_ms'] = round(time_to_first_frame * 1000)
+    if encode_pipeline is not None:
+        stats['pipeline'] = encode_pipeline.stats()
+    if recorder is not None:
+        stats['recording'] = recorder.stats()
+    if capture_stages:
+        stats['sources'] = {source_id: stage.stats() for source_id, stage in capture_stages.items()}
+    # Latencia de punta a punta: desde la captura del frame hasta que terminó de salir por el socket
+    latencies = [client['latency_ms'] for client in stats['clients'] if client['frames_sent']]
+    if latencies:
+        stats['glass_to_wire_ms'] = {'avg': round(sum(latencies) / len(latencies), 1), 'max': max(latencies)}
+    return stats
+
+def collect_source_metrics():
+    # Series por fuente adicional o relay; desaparecen solas al detenerse la transmisión
+    stages = list(capture_stages.items())
+    relays = [(source_id, stage) for source_id, stage in stages if isinstance(stage, RelayStage)]
+    return [
+        ('scam_source_frames_captured_total', 'counter', "Frames capturados de cada fuente adicional",
+         [({'source': source_id}, stage.frames) for source_id, stage in stages]),
+        ('scam_source_idle', 'gauge', "1 si la fuente está liberada por falta de clientes",
+         [({'source': source_id}, int(stage.idle)) for source_id, stage in stages]),
+        ('scam_source_encode_queue_depth', 'gauge', "Frames de cada fuente esperando un encoder",
+         [({'source': source_id}, stage.pipeline.stats()['capture_queue'])
+          for source_id, stage in stages if stage.pipeline is not None]),
+        ('scam_relay_connected', 'gauge', "1 si el relay está conectado a su instancia upstream",
+         [({'source': source_id}, int(stage.connected)) for source_id, stage in relays]),
+        ('scam_relay_reconnects_total', 'counter', "Reconexiones al upstream desde que arrancó el relay",
+         [({'source': source_id}, stage.reconnects) for source_id, stage in relays]),
+        ('scam_relay_bytes_received_total', 'counter', "Bytes de JPEG recibidos del upstream",
+         [({'source': source_id}, stage.bytes) for source_id, stage in relays]),
+        ('scam_relay_upstream_age_seconds', 'gauge', "Segundos desde el último frame recibido del upstream",
+         [({'source': source_id}, stage.upstream_age()) for source_id, stage in relays]),
+        ('scam_relay_frame_delay_seconds', 'gauge',
+         "Demora promedio de llegada de los frames respecto de su captura en el upstream",
+         [({'source': source_id}, stage.frame_delay) for source_id, stage in relays]),
+    ]
+
+metrics.add_collector(collect_source_metrics)
+
+def handle_client_report(ip, report):
+    # Informe periódico del cliente del navegador: estadísticas de decodificación más los logs acumulados
+    logs = report.get('logs') or []
+    # Validar todo antes de registrar nada: un informe inválido se rechaza entero con 400
+    if not isinstance(logs, list) or not all(isinstance(entry, dict) for entry in logs[:MAX_REPORT_LOGS]):
+        raise ValueError("Logs inválidos en el informe")
+    viewer_reports.update(ip, report)
+    for entry in logs[:MAX_REPORT_LOGS]:
+        handle_client_log(ip, entry)
+
+def handle_client_log(ip, log_data):
+    # Un navegador que se reconecta en bucle no puede inundar el log: límite por cliente y mensajes acotados
+    allowed, suppressed = client_log_limiter.allow(ip)
+    if not allowed:
         return
-    else:
-        # Attempt to grab a frame to ensure the camera is truly available
-        ret, frame = cap.read()
-        if not ret:
-            messagebox.showerror("Error", "La cámara está en uso por otra aplicación o no está disponible.")
-            if cap is not None:
-                cap.release()
-            return
-        else:
-            messagebox.showinfo("Éxito", f"Cámara {camera_index} disponible. Iniciando transmisión.")
-            if cap is not None:
-                cap.release()  # Release the camera after checking its availability
-
-    # Obtener la dirección IP local
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-    except Exception as e:
-        local_ip = "127.0.0.1"
-        logging.error(f"No se pudo obtener la IP local, usando localhost: {e}")
-
-    streaming = True
-    create_tray_icon("green")
-    frame_count = 0
-
-    if root is not None:
-        root.after(0, lambda: root.withdraw())
-
-    app = Flask(__name__)
-
-    # Desactivar el logging de Flask
-    app.logger.disabled = True
-    logging.getLogger('werkzeug').disabled = True
-
-    # HTML para el cliente con pantalla completa
-    html_content = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>SCam</title>
-        <style>
-            body, html {
-                margin: 0;
-                padding: 0;
-                height: 100%; /* Fill the entire viewport */
-                width: 100%;  /* Fill the entire viewport */
-                overflow: hidden; /* Prevent scrollbars */
+    level = {'error': logging.ERROR, 'warning': logging.WARNING}.get(log_data.get('level'), logging.INFO)
+    message = str(log_data.get('message', ''))[:MAX_CLIENT_LOG_LENGTH]
+    if suppressed:
+        message += f" ({suppressed} logs anteriores de este cliente descartados)"
+    logging.log(level, f"Client log {ip}: {message}", extra={'client': ip})
+
+# HTML para el cliente con pantalla completa: lee el multipart con fetch, decodifica con createImageBitmap
+# fuera del hilo principal y dibuja en un canvas sólo en requestAnimationFrame
+HTML_CONTENT = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>SCam</title>
+    <style>
+        body, html {
+            margin: 0;
+            padding: 0;
+            height: 100%;
+            width: 100%;
+            overflow: hidden;
+            background: black;
+        }
+        #stream {
+            display: block;
+            width: 100%;
+            height: 100%;
+            object-fit: contain; /* Mantener la relación de aspecto dentro del viewport */
+        }
+        #loading {
+            position: absolute;
+            top: 50%;
+            left: 50%;
+            transform: translate(-50%, -50%);
+            font-size: 2em;
+            color: white;
+            z-index: 10;
+        }
+    </style>
+</head>
+<body>
+    <div id="loading">Cargando...</div>
+    <canvas id="stream"></canvas>
+
+    <script>
+        // ES5 a propósito y en su propio script: un navegador viejo que no entiende el cliente de abajo
+        // (async, const, flechas) igual tiene que poder ejecutar esto. Sin fetch con streams o sin
+        // createImageBitmap se usa el cliente anterior
+        var legacyClient = !window.ReadableStream || !window.createImageBitmap || !window.AbortController;
+        if (legacyClient) {
+            location.replace('/legacy');
+        }
+    </script>
+    <script>
+        const canvas = document.getElementById('stream');
+        const context = canvas.getContext('2d');
+        const loadingElement = document.getElementById('loading');
+        const streamUrl = '/video?adaptive=1';
+        const reconnectInterval = 3000;
+        const stallTimeout = 10000;  // Sin datos durante este tiempo se reconecta
+        const reportInterval = 5000;  // Cada cuánto se envían las estadísticas y los logs juntos a /report
+        const maxPendingLogs = 20;  // Logs guardados entre informes; los demás se descartan
+        const viewerId = Math.random().toString(36).slice(2, 10);
+        const headerEnd = [13, 10, 13, 10];  // Línea vacía (CR LF CR LF) al final de las cabeceras de cada parte
+
+        const stats = { received: 0, decoded: 0, drawn: 0, dropped: 0 };
+        let pendingLogs = [];
+        let drawnSinceReport = 0;
+        let lastReport = performance.now();
+        let lastData = performance.now();
+        let decoding = false;
+        let nextJpeg = null;  // Frame que llegó mientras se decodificaba el anterior
+        let latestBitmap = null;  // Último frame decodificado que todavía no se dibujó
+        let drawRequested = false;
+
+        function logToServer(level, message) {
+            console.log(level + ': ' + message);
+            if (pendingLogs.length < maxPendingLogs) {
+                pendingLogs.push({ level: level, message: message });
             }
-            #stream {
-                display: block;
-                max-width: 100%; /* Ensure it doesn't exceed the viewport width */
-                max-height: 100%; /* Ensure it doesn't exceed the viewport height */
-                object-fit: contain; /* Maintain aspect ratio and fit inside the viewport */
-                position: absolute; /* Position it to cover the entire viewport */
-                top: 0;
-                left: 0;
+        }
+
+        function sendReport(final) {
+            const now = performance.now();
+            const body = JSON.stringify({
+                viewer: viewerId,
+                fps: drawnSinceReport * 1000 / Math.max(1, now - lastReport),
+                received: stats.received,
+                decoded: stats.decoded,
+                drawn: stats.drawn,
+                dropped: stats.dropped,
+                logs: pendingLogs
+            });
+            pendingLogs = [];
+            drawnSinceReport = 0;
+            lastReport = now;
+            if (final && navigator.sendBeacon) {
+                navigator.sendBeacon('/report', body);
+                return;
             }
-            #loading {
-                position: absolute;
-                top: 50%;
-                left: 50%;
-                transform: translate(-50%, -50%);
-                font-size: 2em;
-                color: white;
-                z-index: 10;
+            fetch('/report', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: body,
+                keepalive: true
+            }).catch(error => console.error('Error al enviar el informe al servidor:', error));
+        }
+
+        function draw() {
+            drawRequested = false;
+            if (!latestBitmap) {
+                return;
             }
-        </style>
-    </head>
-    <body>
-        <div id="loading">Cargando...</div>
-        <img id="stream" src="/video" alt="Fullscreen Stream" style="display:none;">
-
-        <script>
-            const streamElement = document.getElementById('stream');
-            const loadingElement = document.getElementById('loading');
-            const streamUrl = '/video';
-            let reconnectInterval = 3000;
-            let imgCache = [];
-            let imgIndex = 0;
-            let maxCacheSize = 3;
-
-            function logToServer(level, message) {
-                fetch('/log', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({ level: level, message: message })
-                }).catch(error => {
-                    console.error('Error al enviar el log al servidor:', error);
+            if (canvas.width !== latestBitmap.width || canvas.height !== latestBitmap.height) {
+                canvas.width = latestBitmap.width;
+                canvas.height = latestBitmap.height;
+            }
+            context.drawImage(latestBitmap, 0, 0);
+            latestBitmap.close();
+            latestBitmap = null;
+            stats.drawn++;
+            drawnSinceReport++;
+            loadingElement.style.display = 'none';
+        }
+
+        function decode(jpeg) {
+            // Una sola decodificación en curso: si llega otro frame, el que esperaba queda viejo y se descarta
+            if (decoding) {
+                if (nextJpeg) {
+                    stats.dropped++;
+                }
+                nextJpeg = jpeg;
+                return;
+            }
+            decoding = true;
+            createImageBitmap(new Blob([jpeg], { type: 'image/jpeg' }))
+                .then(bitmap => {
+                    stats.decoded++;
+                    if (latestBitmap) {
+                        latestBitmap.close();  // No llegó a dibujarse antes del siguiente
+                        stats.dropped++;
+                    }
+                    latestBitmap = bitmap;
+                    if (!drawRequested) {
+                        drawRequested = true;
+                        requestAnimationFrame(draw);
+                    }
+                })
+                .catch(error => logToServer('warning', 'No se pudo decodificar un frame: ' + error))
+                .finally(() => {
+                    decoding = false;
+                    if (nextJpeg) {
+                        const jpeg = nextJpeg;
+                        nextJpeg = null;
+                        decode(jpeg);
+                    }
                 });
+        }
+
+        function indexOf(buffer, length, pattern, from) {
+            for (let i = from; i + pattern.length <= length; i++) {
+                let j = 0;
+                while (j < pattern.length && buffer[i + j] === pattern[j]) {
+                    j++;
+                }
+                if (j === pattern.length) {
+                    return i;
+                }
             }
+            return -1;
+        }
 
-            function loadStream() {
-                const img = new Image();
-                img.onload = () => {
-                    imgCache.push(img.src);
-                    if (imgCache.length > maxCacheSize) {
-                        imgCache.shift();
+        async function readStream(signal) {
+            const response = await fetch(streamUrl + '&_=' + Date.now(), { cache: 'no-store', signal: signal });
+            if (!response.ok || !response.body) {
+                throw new Error('HTTP ' + response.status);
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = new Uint8Array(256 * 1024);
+            let length = 0;
+            let needed = 0;  // Bytes del JPEG de la parte actual; 0 mientras se leen las cabeceras
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) {
+                    throw new Error('El servidor cerró el stream');
+                }
+                lastData = performance.now();
+                if (length + value.length > buffer.length) {
+                    const bigger = new Uint8Array(Math.max(buffer.length * 2, length + value.length));
+                    bigger.set(buffer.subarray(0, length));
+                    buffer = bigger;
+                }
+                buffer.set(value, length);
+                length += value.length;
+                // Cada parte trae Content-Length: el JPEG se corta sin buscar el boundary dentro de los datos
+                let offset = 0;
+                while (true) {
+                    if (!needed) {
+                        const end = indexOf(buffer, length, headerEnd, offset);
+                        if (end < 0) {
+                            break;
+                        }
+                        const match = /content-length: *([0-9]+)/i.exec(decoder.decode(buffer.subarray(offset, end)));
+                        if (!match) {
+                            throw new Error('Parte sin Content-Length');
+                        }
+                        needed = parseInt(match[1], 10);
+                        offset = end + headerEnd.length;
                     }
-                    if (imgIndex >= imgCache.length) {
-                        imgIndex = imgCache.length - 1;
+                    if (length - offset < needed) {
+                        break;
                     }
-                    streamElement.src = imgCache[imgIndex];
-                    streamElement.style.display = 'block';
-                    loadingElement.style.display = 'none';
-                };
-                img.onerror = (error) => {
+                    stats.received++;
+                    decode(buffer.slice(offset, offset + needed));  // Copia: el buffer se reutiliza
+                    offset += needed;
+                    needed = 0;
+                }
+                buffer.copyWithin(0, offset, length);
+                length -= offset;
+            }
+        }
+
+        function start() {
+            const controller = new AbortController();
+            lastData = performance.now();
+            const watchdog = setInterval(() => {
+                if (performance.now() - lastData > stallTimeout) {
+                    controller.abort();
+                }
+            }, 1000);
+            readStream(controller.signal)
+                .catch(error => {
                     console.error('Error al cargar el stream. Reintentando en', reconnectInterval, 'ms', error);
                     logToServer('error', 'Error al cargar el stream. Reintentando la conexión... ' + error);
-                    setTimeout(loadStream, reconnectInterval);
-                };
-                img.src = streamUrl + '?_=' + new Date().getTime();
+                })
+                .finally(() => {
+                    clearInterval(watchdog);
+                    controller.abort();
+                    setTimeout(start, reconnectInterval);
+                });
+        }
+
+        // Con el cliente anterior sólo se declara lo de arriba: no se conecta ni se envían informes
+        if (!legacyClient) {
+            start();
+            setInterval(() => sendReport(false), reportInterval);
+            addEventListener('pagehide', () => sendReport(true));
+        }
+    </script>
+</body>
+</html>
+"""
+
+# Cliente anterior: <img> con el stream y logs y heartbeat por separado; para navegadores sin fetch con streams
+LEGACY_HTML_CONTENT = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>SCam</title>
+    <style>
+        body, html {
+            margin: 0;
+            padding: 0;
+            height: 100%; /* Fill the entire viewport */
+            width: 100%;  /* Fill the entire viewport */
+            overflow: hidden; /* Prevent scrollbars */
+        }
+        #stream {
+            display: block;
+            max-width: 100%; /* Ensure it doesn't exceed the viewport width */
+            max-height: 100%; /* Ensure it doesn't exceed the viewport height */
+            object-fit: contain; /* Maintain aspect ratio and fit inside the viewport */
+            position: absolute; /* Position it to cover the entire viewport */
+            top: 0;
+            left: 0;
+        }
+        #loading {
+            position: absolute;
+            top: 50%;
+            left: 50%;
+            transform: translate(-50%, -50%);
+            font-size: 2em;
+            color: white;
+            z-index: 10;
+        }
+    </style>
+</head>
+<body>
+    <div id="loading">Cargando...</div>
+    <img id="stream" src="/video" alt="Fullscreen Stream" style="display:none;">
+
+    <script>
+        const streamElement = document.getElementById('stream');
+        const loadingElement = document.getElementById('loading');
+        const streamUrl = '/video?adaptive=1';
+        let reconnectInterval = 3000;
+        let imgCache = [];
+        let imgIndex = 0;
+        let maxCacheSize = 3;
+
+        function logToServer(level, message) {
+            fetch('/log', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ level: level, message: message })
+            }).catch(error => {
+                console.error('Error al enviar el log al servidor:', error);
+            });
+        }
+
+        function loadStream() {
+            const img = new Image();
+            img.onload = () => {
+                imgCache.push(img.src);
+                if (imgCache.length > maxCacheSize) {
+                    imgCache.shift();
+                }
+                if (imgIndex >= imgCache.length) {
+                    imgIndex = imgCache.length - 1;
+                }
+                streamElement.src = imgCache[imgIndex];
+                streamElement.style.display = 'block';
+                loadingElement.style.display = 'none';
+            };
+            img.onerror = (error) => {
+                console.error('Error al cargar el stream. Reintentando en', reconnectInterval, 'ms', error);
+                logToServer('error', 'Error al cargar el stream. Reintentando la conexión... ' + error);
+                setTimeout(loadStream, reconnectInterval);
+            };
+            img.src = streamUrl + '&_=' + new Date().getTime();
+        }
+
+        loadStream();
+
+        // Función para actualizar la imagen mostrada
+        function updateImage() {
+          if (imgCache.length > 0) {
+            streamElement.src = imgCache[imgIndex];
+            imgIndex = (imgIndex + 1) % imgCache.length;
+          }
+          setTimeout(updateImage, 30);
+        }
+
+        // Iniciar la actualización de la imagen
+        updateImage();
+
+        function checkHeartbeat() {
+            fetch('/heartbeat', {
+                method: 'GET',
+                mode: 'cors',
+                cache: 'no-cache',
+                headers: {
+                    'Content-Type': 'application/json'
+                }
+            })
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`Heartbeat failed with status ${response.status}`);
+                    }
+                    return response.json();
+                })
+                .then(data => {
+                    if (data.status !== 'ok') {
+                        console.error('Heartbeat failed. Reintentando la conexión...');
+                        logToServer('error', 'Heartbeat failed. Reintentando la conexión...');
+                    }
+                })
+                .catch(error => {
+                    console.error('Error checking heartbeat:', error);
+                    logToServer('error', 'Error checking heartbeat: ' + error);
+                });
+        }
+
+        setInterval(checkHeartbeat, """ + str(HEARTBEAT_INTERVAL * 2) + """);
+    </script>
+</body>
+</html>
+"""
+
+# HTML del cliente por tiles: compone sobre un canvas los tiles que llegan por WebSocket
+TILES_HTML_CONTENT = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>SCam - Tiles</title>
+    <style>
+        body, html {
+            margin: 0;
+            padding: 0;
+            height: 100%;
+            width: 100%;
+            overflow: hidden;
+            background: black;
+        }
+        #canvas {
+            display: block;
+            width: 100%;
+            height: 100%;
+            object-fit: contain; /* Mantener la relación de aspecto dentro del viewport */
+        }
+    </style>
+</head>
+<body>
+    <canvas id="canvas"></canvas>
+
+    <script>
+        const canvas = document.getElementById('canvas');
+        const context = canvas.getContext('2d');
+        const reconnectInterval = 3000;
+        let drawing = Promise.resolve();
+
+        async function drawMessage(buffer) {
+            // Cabecera: tipo, ancho, alto, tamaño de tile, cantidad de tiles (little-endian)
+            const view = new DataView(buffer);
+            const width = view.getUint16(1, true);
+            const height = view.getUint16(3, true);
+            const tileSize = view.getUint16(5, true);
+            const count = view.getUint16(7, true);
+            if (!width || !height) {
+                return;
             }
+            if (canvas.width !== width || canvas.height !== height) {
+                canvas.width = width;
+                canvas.height = height;
+            }
+            let offset = 9;
+            const pending = [];
+            for (let i = 0; i < count; i++) {
+                const column = view.getUint16(offset, true);
+                const row = view.getUint16(offset + 2, true);
+                const length = view.getUint32(offset + 4, true);
+                offset += 8;
+                const blob = new Blob([new Uint8Array(buffer, offset, length)], { type: 'image/jpeg' });
+                offset += length;
+                pending.push(createImageBitmap(blob).then(bitmap => ({ column, row, bitmap })));
+            }
+            // Decodificar todos los tiles fuera del hilo principal y dibujarlos juntos
+            const tiles = await Promise.all(pending);
+            for (const tile of tiles) {
+                context.drawImage(tile.bitmap, tile.column * tileSize, tile.row * tileSize);
+                tile.bitmap.close();
+            }
+        }
+
+        function connect() {
+            const protocol = location.protocol === 'https:' ? 'wss://' : 'ws://';
+            const socket = new WebSocket(protocol + location.host + '/ws/tiles');
+            socket.binaryType = 'arraybuffer';
+            socket.onmessage = (event) => {
+                // Encadenar para que los deltas se dibujen en el orden en que llegaron
+                drawing = drawing.then(() => drawMessage(event.data)).catch(error => {
+                    console.error('Error al dibujar los tiles:', error);
+                });
+            };
+            socket.onclose = () => {
+                console.error('Conexión cerrada. Reintentando en', reconnectInterval, 'ms');
+                setTimeout(connect, reconnectInterval);
+            };
+        }
+
+        connect();
+    </script>
+</body>
+</html>
+"""
+
+# HTML para el modo H.264: MP4 fragmentado reproducido con Media Source Extensions
+MP4_HTML_CONTENT = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>SCam - H.264</title>
+    <style>
+        body, html {
+            margin: 0;
+            padding: 0;
+            height: 100%;
+            width: 100%;
+            overflow: hidden;
+            background: black;
+        }
+        #video {
+            display: block;
+            width: 100%;
+            height: 100%;
+            object-fit: contain; /* Mantener la relación de aspecto dentro del viewport */
+        }
+    </style>
+</head>
+<body>
+    <video id="video" autoplay muted playsinline></video>
+
+    <script>
+        const video = document.getElementById('video');
+        const reconnectInterval = 3000;
+        const maxLatency = 1.0;  // Segundos de atraso tolerados antes de saltar al final del buffer
+        const keepSeconds = 10;  // Segundos de video ya reproducido que se conservan en el buffer
+
+        function findCodecs(bytes) {
+            // Perfil y nivel de la caja avcC del segmento de inicialización
+            for (let i = 0; i + 8 < bytes.length; i++) {
+                if (bytes[i] === 0x61 && bytes[i + 1] === 0x76 && bytes[i + 2] === 0x63 && bytes[i + 3] === 0x43) {
+                    const hex = value => value.toString(16).padStart(2, '0').toUpperCase();
+                    return 'avc1.' + hex(bytes[i + 5]) + hex(bytes[i + 6]) + hex(bytes[i + 7]);
+                }
+            }
+            return null;
+        }
 
-            loadStream();
+        async function play() {
+            const mediaSource = new MediaSource();
+            video.src = URL.createObjectURL(mediaSource);
+            await new Promise(resolve => mediaSource.addEventListener('sourceopen', resolve, { once: true }));
 
-            // Función para actualizar la imagen mostrada
-            function updateImage() {
-              if (imgCache.length > 0) {
-                streamElement.src = imgCache[imgIndex];
-                imgIndex = (imgIndex + 1) % imgCache.length;
-              }
-              setTimeout(updateImage, 30);
+            const response = await fetch('/video.mp4', { cache: 'no-store' });
+            if (!response.ok) {
+                throw new Error('HTTP ' + response.status);
+            }
+            const reader = response.body.getReader();
+            const queue = [];
+            let sourceBuffer = null;
+            let header = new Uint8Array(0);
+
+            function pump() {
+                if (!sourceBuffer || sourceBuffer.updating) {
+                    return;
+                }
+                const buffered = sourceBuffer.buffered;
+                if (buffered.length && video.currentTime - buffered.start(0) > keepSeconds * 2) {
+                    sourceBuffer.remove(buffered.start(0), video.currentTime - keepSeconds);
+                } else if (queue.length) {
+                    sourceBuffer.appendBuffer(queue.shift());
+                }
             }
 
-            // Iniciar la actualización de la imagen
-            updateImage();
-
-            function checkHeartbeat() {
-                fetch('/heartbeat', {
-                    method: 'GET',
-                    mode: 'cors',
-                    cache: 'no-cache',
-                    headers: {
-                        'Content-Type': 'application/json'
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) {
+                    break;
+                }
+                if (!sourceBuffer) {
+                    // Juntar bytes hasta tener el segmento de inicialización para saber el codec
+                    const joined = new Uint8Array(header.length + value.length);
+                    joined.set(header);
+                    joined.set(value, header.length);
+                    header = joined;
+                    const codecs = findCodecs(header);
+                    if (!codecs) {
+                        continue;
                     }
-                })
-                    .then(response => {
-                        if (!response.ok) {
-                            throw new Error(`Heartbeat failed with status ${response.status}`);
-                        }
-                        return response.json();
-                    })
-                    .then(data => {
-                        if (data.status !== 'ok') {
-                            console.error('Heartbeat failed. Reintentando la conexión...');
-                            logToServer('error', 'Heartbeat failed. Reintentando la conexión...');
+                    sourceBuffer = mediaSource.addSourceBuffer('video/mp4; codecs="' + codecs + '"');
+                    sourceBuffer.addEventListener('updateend', () => {
+                        // Mantenerse cerca del final: un cliente atrasado salta al último frame recibido
+                        const buffered = sourceBuffer.buffered;
+                        if (buffered.length) {
+                            const end = buffered.end(buffered.length - 1);
+                            if (video.currentTime < buffered.start(0) || end - video.currentTime > maxLatency) {
+                                video.currentTime = Math.max(buffered.start(buffered.length - 1), end - 0.1);
+                            }
                         }
-                    })
-                    .catch(error => {
-                        console.error('Error checking heartbeat:', error);
-                        logToServer('error', 'Error checking heartbeat: ' + error);
+                        pump();
                     });
+                    queue.push(header);
+                } else {
+                    queue.push(value);
+                }
+                pump();
             }
+        }
+
+        function start() {
+            play().catch(error => console.error('Error en el stream H.264:', error))
+                  .finally(() => setTimeout(start, reconnectInterval));
+        }
+
+        start();
+    </script>
+</body>
+</html>
+"""
+
+def create_flask_app():
+    # Flask sólo se importa con el servidor Werkzeug
+    from flask import Response, Flask, request
+    try:
+        from flask_sock import Sock
+        from simple_websocket import ConnectionClosed
+    except ImportError:  # flask-sock es opcional: sin él el streaming por tiles sólo está en el servidor async
+        Sock = None
+
+    app = Flask(__name__)
 
-            setInterval(checkHeartbeat, """ + str(HEARTBEAT_INTERVAL * 2) + """);
-        </script>
-    </body>
-    </html>
-    """
+    # Desactivar el logging de Flask
+    app.logger.disabled = True
+    logging.getLogger('werkzeug').disabled = True
 
     @app.route('/')
     def index():
-        return html_content
+        return HTML_CONTENT
+
+    @app.route('/legacy')
+    def legacy_index():
+        return LEGACY_HTML_CONTENT
+
+    @app.route('/tiles')
+    def tiles_page():
+        return TILES_HTML_CONTENT
+
+    @app.route('/mp4')
+    def mp4_page():
+        return MP4_HTML_CONTENT
+
+    if Sock is not None:
+        sock = Sock(app)
+
+        @sock.route('/ws/tiles')
+        def tiles_socket(ws):
+            stream = tile_stream
+            if stream is None:
+                # Relay o captura en otro proceso: no hay frames crudos para armar tiles
+                ws.close(reason=1011, message="El streaming por tiles no está disponible")
+                return
+            stream.subscribe()
+            last_seq = 0
+            try:
+                while streaming:
+                    frame = stream.hub.wait(last_seq, timeout=FRAME_WAIT_TIMEOUT)
+                    if frame is None:
+                        if stream.hub.closed:
+                            break
+                        continue
+                    last_seq, data = stream.message_for(frame, last_seq)
+                    ws.send(data)
+            except ConnectionClosed:
+                pass
+            finally:
+                stream.unsubscribe()
+    else:
+        logging.info("flask-sock no está instalado: /ws/tiles sólo está disponible con el servidor async")
 
     @app.route('/video')
-    def video_stream():
+    @app.route('/video/<source_id>')
+    def video_stream(source_id=None):
         client_ip = request.remote_addr  # Obtener la IP del cliente
-        start_time = None  # Inicializar start_time fuera del bucle
+        # /video es la fuente principal; las demás se sirven en /video/<id>
+        stream_renditions = renditions if source_id is None else source_renditions.get(source_id)
+        if stream_renditions is None:
+            return Response(f"No existe la fuente {source_id}", status=404)
+        # Variante pedida por el cliente, p. ej. /video?w=640&q=60
+        requested = stream_renditions.normalize(request.args.get('w', type=int), request.args.get('q', type=int))
+        controller = quality_controller(stream_renditions, request.args)
+        if controller is not None:
+            requested = controller.key
 
         def generate():
-            nonlocal start_time
-            global frame_buffer, streaming, last_delay_log_time
-            while streaming:
-                try:
-                    if frame_buffer is not None:
-                        if start_time is None:
-                            start_time = time.time()
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame_buffer + b'\r\n')
-                        # Calcular el retraso y almacenarlo
-                        end_time = time.time()
-                        delay = (end_time - start_time) * 1000  # Retraso en ms
-
-                        # Throttling del log de retraso
-                        now = time.time()
-                        if client_ip not in last_delay_log_time or now - last_delay_log_time[client_ip] >= DELAY_LOG_INTERVAL:
-                            if delay > 200:
-                                logging.info(f"Client {client_ip} delay: {delay:.2f} ms")
-                            last_delay_log_time[client_ip] = now  # Actualizar el tiempo del último log
-
-                        client_delays[client_ip] = delay
-                        start_time = time.time()  # Reiniciar el tiempo de inicio para el próximo frame
-                        time.sleep(0.01)  # Pequeña pausa para evitar el uso excesivo de la CPU
-                    else:
-                        cv2.waitKey(10)
-                except Exception as e:
-                    logging.error(f"Error en generate(): {e}")
-                    streaming = False  # Detener la transmisión en caso de error
-                    break  # Salir del bucle generate
+            global streaming
+            last_seq = 0
+            rendition, frame_hub = stream_renditions.subscribe(requested)
+            if controller is not None:
+                controller.sync(rendition)
+            client = client_registry.register(client_ip, rendition)
+            try:
+                while streaming:
+                    try:
+                        # Esperar a que se publique un frame nuevo; si el cliente se atrasó recibe el más reciente
+                        frame = frame_hub.wait(last_seq, timeout=FRAME_WAIT_TIMEOUT)
+                        if frame is None:
+                            continue
+                        last_seq = frame.seq
+                        # Werkzeug escribe cada parte de forma bloqueante: cuando el generador se reanuda
+                        # el frame ya salió completo por el socket
+                        client.begin_frame(frame)
+                        # La parte multipart se comparte entre todos los clientes: se envía por piezas
+                        # en lugar de concatenar (y copiar) el JPEG para cada conexión
+                        yield from frame.chunks
+                        client.end_frame(frame)
+                        record_client_delay(client)
+                        if controller is not None:
+                            # Cambiar de variante si el enlace del cliente lo exige o hay margen
+                            new_rendition = controller.update(client)
+                            if new_rendition is not None and new_rendition != rendition:
+                                # Suscribir antes de soltar la actual: si se sirve la misma variante
+                                # (p. ej. se llegó al máximo de variantes) sigue sin cortes
+                                served, served_hub = stream_renditions.subscribe(new_rendition)
+                                stream_renditions.unsubscribe(rendition)
+                                controller.sync(served)
+                                if served != rendition:
+                                    rendition, frame_hub = served, served_hub
+                                    client.switch_rendition(rendition)
+                                    last_seq = 0
+                    except Exception as e:
+                        logging.error(f"Error en generate(): {e}")
+                        streaming = False  # Detener la transmisión en caso de error
+                        break  # Salir del bucle generate
+            finally:
+                client_registry.unregister(client)
+                stream_renditions.unsubscribe(rendition)
 
         return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+    @app.route('/video.mp4')
+    def video_mp4():
+        # H.264 codificado una sola vez por ffmpeg; cada cliente empieza en un keyframe
+        if mp4_stream is None:
+            return Response("ffmpeg no está disponible", status=503)
+        client_ip = request.remote_addr
+
+        def generate():
+            cursor = FragmentCursor()
+            mp4_stream.subscribe()
+            client = client_registry.register(client_ip, ('h264', FMP4_BITRATE))
+            try:
+                while streaming:
+                    frame = mp4_stream.hub.wait(cursor.last_seq, timeout=FRAME_WAIT_TIMEOUT)
+                    if frame is None:
+                        if mp4_stream.hub.closed:
+                            break
+                        continue
+                    chunks = cursor.accept(frame)
+                    if not chunks:
+                        continue
+                    sent = frame._replace(data=chunks[-1])
+                    client.begin_frame(sent)
+                    yield from chunks
+                    client.end_frame(sent)
+            finally:
+                client_registry.unregister(client)
+                mp4_stream.unsubscribe()
+
+        return Response(generate(), mimetype='video/mp4', headers={'Cache-Control': 'no-cache'})
+
+    @app.route('/replay')
+    def replay():
+        # /replay?from=<hora Unix o -segundos>&speed=1: frames grabados, sin decodificar
+        if recorder is None:
+            return Response("La grabación no está activada", status=404)
+        try:
+            start = parse_replay_start(request.args.get('from', '-60'))
+            clock = ReplayClock(float(request.args.get('speed', 1)))
+        except ValueError:
+            return Response("Parámetros inválidos", status=400)
+
+        def generate():
+            for timestamp, data in recorder.frames(start):
+                if not streaming:
+                    break
+                delay = clock.delay(timestamp)
+                if delay:
+                    time.sleep(delay)
+                yield from multipart_chunks(data)
+
+        return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    @app.route('/stats')
+    def stats():
+        return Response(json.dumps(stream_stats()), mimetype='application/json')
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics.json')
+    def metrics_snapshot():
+        return Response(json.dumps(metrics.snapshot()), mimetype='application/json')
+
     @app.route('/heartbeat')
     def heartbeat():
         return json.dumps({'status': 'ok'})
 
     @app.route('/log', methods=['POST'])
     def log_message():
-        log_data = request.get_json()
-        level = log_data['level']
-        message = log_data['message']
-
-        if level == 'error':
-            logging.error(f"Client log: {message}")
-        elif level == 'info':
-            logging.info(f"Client log: {message}")
-        elif level == 'warning':
-            logging.warning(f"Client log: {message}")
-        else:
-            logging.info(f"Client log: {message}")
-
+        log_data = request.get_json(force=True, silent=True)
+        if not isinstance(log_data, dict):
+            return Response("Log inválido", status=400)
+        handle_client_log(request.remote_addr, log_data)
         return json.dumps({'status': 'ok'})
 
-    def flask_thread():
-        app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
-
-    threading.Thread(target=flask_thread, daemon=True).start()
-
-    while streaming:
+    @app.route('/report', methods=['POST'])
+    def client_report():
+        # sendBeacon envía el JSON como text/plain
+        report = request.get_json(force=True, silent=True)
+        if not isinstance(report, dict):
+            return Response("Informe inválido", status=400)
         try:
-            cap = cv2.VideoCapture(camera_index)  # Abrir la cámara seleccionada
-            if not cap.isOpened():
-                messagebox.showerror("Error", "La cámara está en uso por otra aplicación. Intentando de nuevo...")
-                if cap is not None:
-                    cap.release()
-                time.sleep(5)  # Esperar 5 segundos antes de intentar de nuevo
-                continue  # Volver al inicio del bucle while
-            else:
-                messagebox.showinfo("Éxito", f"Cámara {camera_index} disponible. Iniciando transmisión.")
-                break  # Salir del bucle while si la cámara se abre correctamente
-        except Exception as e:
-            logging.error(f"Error al intentar abrir la cámara: {e}")
-            messagebox.showerror("Error", f"Error al intentar abrir la cámara: {e}. Intentando de nuevo...")
-            time.sleep(5)
+            handle_client_report(request.remote_addr, report)
+        except (TypeError, ValueError, KeyError):
+            return Response("Informe inválido", status=400)
+        return json.dumps({'status': 'ok'})
+
+    return app
+
+def check_source(source):
+    # Ensure the camera index is valid. La fuente se abre y se lee por primera vez en el hilo de captura
+    # (start_primary_capture), que es el único que la usa
+    if isinstance(source, CameraSource):
+        cameras = list_cameras()
+        if cameras and source.index not in [cam["index"] for cam in cameras]:
+            show_error(f"Índice de cámara {source.index} fuera de rango.")
+            return False
+    return True
+
+def parse_source_arg(value, position):
+    # "--source puerta=camera:0" da el id "puerta"; sin id explícito se usa la posición en la lista
+    source_id, separator, spec = value.partition('=')
+    if separator and ':' not in source_id and source_id.replace('-', '').replace('_', '').isalnum():
+        return source_id, spec
+    return str(position), value
+
+def prepare_source(source_id, spec):
+    # La URL de un relay se deja como está (validada) y el resto se convierte en FrameSource sin abrirla
+    try:
+        url = relay_url(spec)
+        if url is not None:
+            check_relay_url(url)
+            return spec
+        return make_source(spec, LOW_LATENCY_CAPTURE)
+    except ValueError as e:
+        raise ValueError(f"Fuente {source_id} inválida: {e}")
+
+def start_capture_stages(extra_sources):
+    # Cada fuente adicional tiene su captura y sus variantes, pero comparte los encoders con las demás.
+    # Las fuentes ya pasaron por prepare_source()
+    for source_id, spec in extra_sources:
+        url = relay_url(spec)
+        if url is not None:
+            start_relay_stage(source_id, url, RenditionSet(default_quality=JPEG_QUALITY,
+                                                           idle_timeout=RENDITION_IDLE_TIMEOUT, max_renditions=1))
             continue
+        source = make_source(spec)
+        stage_renditions = RenditionSet(default_quality=JPEG_QUALITY, idle_timeout=RENDITION_IDLE_TIMEOUT,
+                                        max_renditions=MAX_RENDITIONS)
+        detector = ChangeDetector(CHANGE_PIXEL_THRESHOLD, CHANGE_AREA_THRESHOLD) if CHANGE_DETECTION else None
+        pipeline = EncodePipeline(stage_renditions, max_queue=ENCODE_QUEUE_SIZE, detector=detector,
+                                  keepalive_interval=KEEPALIVE_INTERVAL, pool=encode_pool)
+        stage = CaptureStage(source_id, source, stage_renditions, pipeline, idle_timeout=SOURCE_IDLE_TIMEOUT,
+                             low_latency=LOW_LATENCY_CAPTURE)
+        capture_stages[source_id] = stage
+        source_renditions[source_id] = stage_renditions
+        stage.start()
+        logging.info(f"Fuente {source.name} disponible en /video/{source_id}")
+
+def start_relay_stage(source_id, url, stage_renditions):
+    # Un edge abre una sola conexión al upstream y reparte los JPEG recibidos a sus propios clientes
+    try:
+        stage = RelayStage(source_id, url, stage_renditions, idle_timeout=SOURCE_IDLE_TIMEOUT,
+                           retry_interval=RELAY_RETRY_INTERVAL, max_retry_interval=RELAY_MAX_RETRY_INTERVAL)
+    except ValueError as e:
+        logging.error(f"Fuente {source_id} inválida: {e}")
+        return None
+    capture_stages[source_id] = stage
+    source_renditions[source_id] = stage_renditions
+    stage.start()
+    logging.info(f"Relay de {url} disponible en /video/{source_id}")
+    return stage
+
+def stop_capture_stages():
+    for stage in capture_stages.values():
+        stage.stop()
+    capture_stages.clear()
+    source_renditions.clear()
+
+def start_server(port, source, server_mode='flask', capture_mode='thread', ring_name=None, source_id=None,
+                 extra_sources=()):
+    global app, renditions, encode_pipeline, encode_pool, tile_stream, mp4_stream, recorder, streaming, root
+    global time_to_first_frame
 
-    if not streaming:
-        logging.info("Transmisión cancelada debido a que la cámara no está disponible.")
-        create_tray_icon("red")
-        return
+    if not is_port_available(port):
+        show_error(f"El puerto {port} ya está en uso. Prueba con otro.")
+        return EXIT_PORT_IN_USE
 
+    source_spec = source
+    upstream_url = relay_url(source)
     try:
-        # Establecer la resolución de la cámara (opcional)
-        # cap_width = 640
-        # cap_height = 480
-        # cap.set(cv2.CAP_PROP_FRAME_WIDTH, cap_width)  # Ancho
-        # cap.set(cv2.CAP_PROP_FRAME_HEIGHT, cap_height)  # Alto
+        if upstream_url is not None:
+            capture_mode = 'relay'
+            check_relay_url(upstream_url)
+        else:
+            source = make_source(source, LOW_LATENCY_CAPTURE)
+        # Todas las fuentes se validan antes de arrancar: una inválida es un error de uso, no se omite
+        extra_sources = [(source_id, prepare_source(source_id, spec)) for source_id, spec in extra_sources]
+    except ValueError as e:
+        show_error(str(e))
+        return EXIT_USAGE
 
-        while streaming:
-            try:
-                # Check if the camera is still available
-                if cap is None or not cap.isOpened():
-                    logging.error("Cámara no disponible, intentando reconectar...")
-                    if cap is not None:
-                        cap.release()
-                    cap = None
-                    time.sleep(5)  # Wait before retrying
-                    try:
-                        cap = cv2.VideoCapture(camera_index)
-                        if not cap.isOpened():
-                            logging.error("No se pudo reabrir la cámara.")
-                            continue  # Skip to the next iteration of the streaming loop
-                    except Exception as e:
-                        logging.error(f"Error al intentar reabrir la cámara: {e}")
-                        continue  # Skip to the next iteration of the streaming loop
-                    logging.info("Cámara reconectada exitosamente.")
-
-                ret, frame = cap.read()
-                if not ret:
-                    logging.error("Error al capturar el frame de la cámara")
-                    # Attempt to re-open the camera
-                    if cap is not None:
-                        cap.release()
-                    cap = None
-                    time.sleep(5)  # Wait before retrying
-                    while True:
-                        try:
-                            cap = cv2.VideoCapture(camera_index)
-                            if not cap.isOpened():
-                                logging.error("No se pudo reabrir la cámara. Intentando de nuevo...")
-                                time.sleep(5)
-                                continue
-                             # Establecer la resolución de la cámara (opcional)
-                            # cap.set(cv2.CAP_PROP_FRAME_WIDTH, cap_width)  # Ancho
-                            # cap.set(cv2.CAP_PROP_FRAME_HEIGHT, cap_height)  # Alto
-                            break  # Camera re-opened successfully
-                        except Exception as e:
-                            logging.error(f"Error al intentar reabrir la cámara: {e}")
-                            time.sleep(5)
-                    continue  # Skip to the next iteration of the streaming loop
-
-                frame_count += 1
-
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 30])
-                frame_buffer = buffer.tobytes()
-                time.sleep(0.01)  # Pequeña pausa para evitar el uso excesivo de la CPU
-            except Exception as e:
-                logging.error(f"Error durante la captura del frame: {e}")
-                messagebox.showerror("Error", "La cámara puede estar en uso o desconectada. Intente reiniciar la transmisión.")
-                streaming = False
-                break
-
-        if cap is not None:
-            cap.release()
+    # Con captura en otro proceso la fuente la abre el proceso de captura
+    if capture_mode == 'thread' and ring_name is None and not check_source(source):
+        return EXIT_SOURCE_UNAVAILABLE
+
+    # Obtener la dirección IP local
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        local_ip = s.getsockname()[0]
+        s.close()
     except Exception as e:
-        logging.error(f"Error durante la captura de la cámara: {e}")
+        local_ip = "127.0.0.1"
+        logging.error(f"No se pudo obtener la IP local, usando localhost: {e}")
+
+    streaming = True
+    create_tray_icon("green")
+    time_to_first_frame = None
+    if capture_mode == 'thread' and ring_name is None:
+        renditions = RenditionSet(default_quality=JPEG_QUALITY, idle_timeout=RENDITION_IDLE_TIMEOUT,
+                                  max_renditions=MAX_RENDITIONS)
+        detector = ChangeDetector(CHANGE_PIXEL_THRESHOLD, CHANGE_AREA_THRESHOLD) if CHANGE_DETECTION else None
+        encode_pool = EncodePool(ENCODER_WORKERS)
+        encode_pipeline = EncodePipeline(renditions, max_queue=ENCODE_QUEUE_SIZE, detector=detector,
+                                         keepalive_interval=KEEPALIVE_INTERVAL, metrics=metrics, pool=encode_pool)
+        tile_stream = TileStream(encode_pipeline.raw_hub, tile_size=TILE_SIZE, quality=TILE_QUALITY,
+                                 keyframe_interval=TILE_KEYFRAME_INTERVAL, pixel_threshold=TILE_PIXEL_THRESHOLD,
+                                 frame_timeout=FRAME_WAIT_TIMEOUT)
+        ffmpeg = find_ffmpeg()
+        if ffmpeg:
+            mp4_stream = Fmp4Stream(encode_pipeline.raw_hub, ffmpeg, fps=FMP4_FPS, bitrate=FMP4_BITRATE,
+                                    gop_seconds=FMP4_GOP, idle_timeout=SOURCE_IDLE_TIMEOUT,
+                                    frame_timeout=FRAME_WAIT_TIMEOUT)
+        else:
+            mp4_stream = None
+            logging.info("ffmpeg no está instalado: /video.mp4 no está disponible")
+    elif capture_mode == 'relay':
+        # Edge de otra instancia: los JPEG llegan ya codificados y se reenvían sin decodificar
+        renditions = RenditionSet(default_quality=JPEG_QUALITY, idle_timeout=RENDITION_IDLE_TIMEOUT,
+                                  max_renditions=1)
+        encode_pipeline = None
+        tile_stream = None
+        mp4_stream = None
+        encode_pool = EncodePool(ENCODER_WORKERS) if extra_sources else None
+    else:
+        # Los JPEG llegan ya codificados desde el anillo compartido: sólo existe la variante por defecto
+        # y no hay frames crudos para el streaming por tiles
+        renditions = RenditionSet(default_quality=JPEG_QUALITY, idle_timeout=RENDITION_IDLE_TIMEOUT,
+                                  max_renditions=1)
+        encode_pipeline = None
+        tile_stream = None
+        mp4_stream = None
+        if extra_sources:
+            logging.warning("Las fuentes adicionales sólo se sirven con captura en este proceso; se ignoran")
+            extra_sources = ()
+    if capture_mode == 'thread' and ring_name is None and not start_primary_capture(source, source_id):
         streaming = False
         create_tray_icon("red")
+        return EXIT_SOURCE_UNAVAILABLE
+    if source_id is not None:
+        source_renditions[source_id] = renditions
+    start_capture_stages(extra_sources)
+
+    recorder = None
+    if RECORD_DIRECTORY:
+        # El grabador es un suscriptor más de la variante por defecto y corre en su propio hilo
+        _, record_hub = renditions.subscribe(renditions.default_key)
+        recorder = SegmentRecorder(RECORD_DIRECTORY, record_hub, segment_size=RECORD_SEGMENT_SIZE,
+                                   quota=RECORD_QUOTA, frame_timeout=FRAME_WAIT_TIMEOUT)
+        recorder.start()
+        logging.info(f"Grabando en {RECORD_DIRECTORY} (cuota {RECORD_QUOTA // 2 ** 20} MB)")
+
+    if root is not None:
+        root.after(0, lambda: root.withdraw())
+
+    def flask_thread():
+        app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
+
+    def async_thread():
+        pages = {'/': HTML_CONTENT, '/legacy': LEGACY_HTML_CONTENT, '/tiles': TILES_HTML_CONTENT,
+                 '/mp4': MP4_HTML_CONTENT}
+        server = AsyncStreamServer(renditions, pages, handle_client_log, client_registry,
+                                   on_client_report=handle_client_report,
+                                   on_frame_sent=record_client_delay, stats=stream_stats,
+                                   controller_factory=quality_controller, tile_stream=tile_stream,
+                                   is_running=lambda: streaming, frame_timeout=FRAME_WAIT_TIMEOUT,
+                                   max_client_buffer=MAX_CLIENT_BUFFER, metrics=metrics, recorder=recorder,
+                                   sources=source_renditions, mp4_stream=mp4_stream)
+        server.run('0.0.0.0', port)
+
+    if server_mode == 'async':
+        threading.Thread(target=async_thread, daemon=True).start()
+    else:
+        app = create_flask_app()
+        threading.Thread(target=flask_thread, daemon=True).start()
+    if ring_name:
+        source_name = f"el anillo {ring_name}"
+    elif upstream_url is not None:
+        source_name = f"el relay de {upstream_url}"
+    else:
+        source_name = source.name
+    logging.info(f"Transmitiendo {source_name} en http://{local_ip}:{port}/ (servidor {server_mode})")
+
+    if capture_mode == 'relay':
+        return run_relay(upstream_url, source_id)
+    if capture_mode == 'process' or ring_name is not None:
+        return read_shared_ring(source_spec, ring_name)
+
+    return run_capture()
+
+def start_primary_capture(source, source_id=None):
+    global capture_stage
+    # La fuente principal es una etapa de captura más; aquí sólo se mide el tiempo hasta el primer frame.
+    # Abrirla y leer el primer frame en su propio hilo también sirve para comprobar que está disponible
+    capture_stage = CaptureStage(source_id or '0', source, renditions, encode_pipeline,
+                                 idle_timeout=SOURCE_IDLE_TIMEOUT, low_latency=LOW_LATENCY_CAPTURE,
+                                 watched=primary_watched, on_first_frame=record_first_frame)
+    capture_stage.start()
+    if capture_stage.wait_available(SOURCE_CHECK_TIMEOUT):
+        show_info(f"{source.name} disponible. Iniciando transmisión.")
+        return True
+    show_error(f"{source.name} no se pudo abrir o no entrega frames. Puede que esté en uso por otra aplicación.")
+    capture_stage.stop()  # Cierra la fuente, el pipeline y las variantes
+    encode_pool.close()
+    tile_stream.close()
+    if mp4_stream is not None:
+        mp4_stream.close()
+    return False
+
+def run_capture():
+    global streaming
+    exit_code = EXIT_OK
+    try:
+        while streaming and capture_stage.is_alive():
+            time.sleep(FRAME_WAIT_TIMEOUT)
+        if capture_stage.error is not None:
+            show_error("La fuente puede estar en uso o desconectada. Intente reiniciar la transmisión.")
+            create_tray_icon("red")
+            exit_code = EXIT_CAPTURE_ERROR
+    finally:
+        streaming = False
+        capture_stage.stop()  # Cierra la fuente, el pipeline y las variantes
+        stop_capture_stages()
+        encode_pool.close()
+        tile_stream.close()
+        if mp4_stream is not None:
+            mp4_stream.close()
+        if recorder is not None:
+            recorder.close()
+    return exit_code
+
+def primary_watched():
+    # La fuente principal también alimenta los tiles y el MP4, que no pasan por las variantes JPEG
+    return renditions.watched() or tile_stream.watched() or (mp4_stream is not None and mp4_stream.watched())
+
+def record_first_frame():
+    global time_to_first_frame
+    if time_to_first_frame is None:
+        time_to_first_frame = time.monotonic() - PROCESS_START
+        logging.info(f"Tiempo hasta el primer frame: {time_to_first_frame * 1000:.0f} ms")
+        if time_to_first_frame > TTFF_BUDGET:
+            logging.warning(f"El primer frame tardó más que el presupuesto de {TTFF_BUDGET * 1000:.0f} ms")
+
+def run_relay(url, source_id=None):
+    global streaming
+    # La fuente principal es otra instancia de SCam: el hilo del relay publica en las variantes de /video
+    stage = start_relay_stage(source_id or '0', url, renditions)
+    if stage is None:
+        streaming = False
+        renditions.close()
+        return EXIT_USAGE
+    try:
+        while streaming:
+            time.sleep(FRAME_WAIT_TIMEOUT)
+    finally:
+        streaming = False
+        stop_capture_stages()
+        if encode_pool is not None:
+            encode_pool.close()
+        if recorder is not None:
+            recorder.close()
+        renditions.close()
+    return EXIT_OK
+
+def read_shared_ring(source_spec, ring_name=None):
+    global streaming
+    # Sin nombre de anillo se crea uno y se lanza el proceso de captura; con nombre se lee uno existente
+    worker = None
+    stop_event = None
+    frame_ready = None  # Lo marca el proceso de captura en cada frame escrito, para no consultar el anillo
+    if ring_name is None:
+        ring = SharedFrameRing.create(slots=RING_SLOTS, slot_size=RING_SLOT_SIZE)
+        context = multiprocessing.get_context('spawn')
+        stop_event = context.Event()
+        frame_ready = context.Event()
+        change_detection = (CHANGE_PIXEL_THRESHOLD, CHANGE_AREA_THRESHOLD) if CHANGE_DETECTION else None
+        worker = context.Process(target=capture_worker, name="scam-capture", daemon=True,
+                                 args=(source_spec, ring.name, stop_event, ENCODER_WORKERS, JPEG_QUALITY,
+                                       change_detection, KEEPALIVE_INTERVAL),
+                                 kwargs={'low_latency': LOW_LATENCY_CAPTURE, 'frame_ready': frame_ready})
+        worker.start()
+        logging.info(f"Proceso de captura iniciado; anillo compartido: {ring.name}")
+    else:
+        try:
+            ring = SharedFrameRing.attach(ring_name)
+        except FileNotFoundError:
+            show_error(f"No existe el anillo compartido {ring_name}.")
+            streaming = False
+            return EXIT_SOURCE_UNAVAILABLE
+
+    exit_code = EXIT_OK
+    last_seq = ring.last_seq()
+    try:
+        while streaming:
+            if time_to_first_frame is not None and not renditions.watched():
+                # Sin clientes ni grabación no hace falta copiar los frames del anillo (salvo el primero,
+                # que mide el tiempo de arranque)
+                renditions.wait_watched(FRAME_WAIT_TIMEOUT)
+                continue
+            if frame_ready is not None:
+                frame_ready.clear()  # Antes de leer: un frame escrito después vuelve a marcarlo
+            frame = ring.read_latest(last_seq)
+            if frame is None:
+                if worker is not None and not worker.is_alive():
+                    show_error("El proceso de captura terminó inesperadamente.")
+                    exit_code = EXIT_CAPTURE_ERROR
+                    break
+                if frame_ready is not None:
+                    frame_ready.wait(FRAME_WAIT_TIMEOUT)
+                else:
+                    time.sleep(RING_POLL_INTERVAL)
+                continue
+            last_seq = frame.seq
+            record_first_frame()
+            # Un único bytes por frame compartido por todos los clientes de este proceso
+            hub = renditions.hub(renditions.default_key)
+            if hub is not None:
+                hub.publish(frame.data, frame.timestamp)
+    finally:
+        streaming = False
+        if worker is not None:
+            stop_event.set()
+            worker.join(timeout=5)
+        if recorder is not None:
+            recorder.close()
+        renditions.close()
+        ring.close()
+    return exit_code
 
 def gui():
     global root
+    # La interfaz sólo importa Tk cuando se usa
+    import tkinter as tk
+    from tkinter import ttk
+    from tkinter import messagebox
+
     root = tk.Tk()
     root.title("Configuración de Transmisión de Cámara")
 
@@ -464,22 +1417,35 @@ def gui():
     port_entry.grid(row=0, column=1, sticky=(tk.E, tk.W))
     port_entry.insert(0, "5000")
 
-    camera_label = ttk.Label(main_frame, text="Dispositivo de Cámara:")
+    camera_label = ttk.Label(main_frame, text="Fuente de Video:")
     camera_label.grid(row=1, column=0, sticky=tk.W)
 
     # Modify camera combobox to show names
-    cameras = list_cameras()
-    camera_names = [cam["name"] for cam in cameras]
+    camera_names = [name for name, _ in source_options()]
     camera_combobox = ttk.Combobox(main_frame, values=camera_names)
     camera_combobox.grid(row=1, column=1, sticky=(tk.E, tk.W))
     if camera_names:
         camera_combobox.current(0)
 
-    start_button = ttk.Button(main_frame, text="Iniciar Transmisión", command=lambda: start(port_entry.get(), camera_combobox.get()))
-    start_button.grid(row=2, column=0, columnspan=2, pady=10)
+    # Actualizar la lista cuando se conecta o desconecta una cámara
+    def on_devices_changed(devices):
+        root.after(0, lambda: camera_combobox.config(values=[name for name, _ in source_options()]))
+
+    device_registry.add_listener(on_devices_changed)
+    device_registry.start()
+
+    server_label = ttk.Label(main_frame, text="Servidor:")
+    server_label.grid(row=2, column=0, sticky=tk.W)
+
+    server_combobox = ttk.Combobox(main_frame, values=list(SERVER_MODES), state="readonly")
+    server_combobox.grid(row=2, column=1, sticky=(tk.E, tk.W))
+    server_combobox.current(0)
+
+    start_button = ttk.Button(main_frame, text="Iniciar Transmisión", command=lambda: start(port_entry.get(), camera_combobox.get(), server_combobox.get()))
+    start_button.grid(row=3, column=0, columnspan=2, pady=10)
 
     status_label = ttk.Label(main_frame, text="Estado: Detenido", foreground="red")
-    status_label.grid(row=3, column=0, columnspan=2)
+    status_label.grid(row=4, column=0, columnspan=2)
 
     root.columnconfigure(0, weight=1)
     root.rowconfigure(0, weight=1)
@@ -487,23 +1453,22 @@ def gui():
 
     create_tray_icon("red")
 
-    def start(port_str, camera_name):
+    def start(port_str, camera_name, server_mode):
         try:
             port = int(port_str)
-            # Find camera index by name
-            cameras = list_cameras()
-            camera_index = next(cam["index"] for cam in cameras if cam["name"] == camera_name)
+            # Find source by name
+            source = next(spec for name, spec in source_options() if name == camera_name)
             
             if not (1024 <= port <= 65535):
                 messagebox.showerror("Error", "El puerto debe estar entre 1024 y 65535.")
                 return
             status_label.config(text="Estado: Iniciando...", foreground="orange")
-            threading.Thread(target=lambda: start_server_wrapper(port, camera_index), daemon=True).start()
+            threading.Thread(target=lambda: start_server_wrapper(port, source, server_mode), daemon=True).start()
         except (ValueError, StopIteration):
-            messagebox.showerror("Error", "Por favor, introduce un número de puerto válido y selecciona una cámara.")
+            messagebox.showerror("Error", "Por favor, introduce un número de puerto válido y selecciona una fuente.")
 
-    def start_server_wrapper(port, camera_index):
-        start_server(port, camera_index)
+    def start_server_wrapper(port, source, server_mode):
+        start_server(port, source, server_mode)
         root.after(0, lambda: update_status_label())
 
     def update_status_label():
@@ -516,35 +1481,125 @@ def gui():
     root.mainloop()
 
 def show_stats():
-    global client_delays
+    import tkinter as tk
+    from tkinter import ttk
 
     stats_window = tk.Toplevel(root)  # Crear una nueva ventana
     stats_window.title("Estadísticas de Transmisión")
 
     # Encabezados de la tabla
-    ip_header = ttk.Label(stats_window, text="Dirección IP", font=('Arial', 10, 'bold'))
-    ip_header.grid(row=0, column=0, padx=5, pady=5)
-    delay_header = ttk.Label(stats_window, text="Retraso (ms)", font=('Arial', 10, 'bold'))
-    delay_header.grid(row=0, column=1, padx=5, pady=5)
+    headers = ["Dirección IP", "Latencia (ms)", "FPS", "Descartados", "En cola (KB)"]
+    for column, text in enumerate(headers):
+        header = ttk.Label(stats_window, text=text, font=('Arial', 10, 'bold'))
+        header.grid(row=0, column=column, padx=5, pady=5)
+
+    rows = {}  # id de cliente -> etiquetas de su fila
+    pipeline_label = ttk.Label(stats_window)
 
     # Función para actualizar las estadísticas periódicamente
     def update_stats():
-        # Eliminar filas existentes (excepto los encabezados)
-        for widget in stats_window.winfo_children():
-            if int(widget.grid_info()['row']) > 0:
-                widget.destroy()
-
-        # Mostrar los datos de retraso de cada cliente
+        if not stats_window.winfo_exists():
+            return
+        # Reutilizar las etiquetas de cada cliente y eliminar sólo las de los que se desconectaron
+        clients = client_registry.snapshot()
+        connected = {client['id'] for client in clients}
+        for client_id in list(rows):
+            if client_id not in connected:
+                for label in rows.pop(client_id):
+                    label.destroy()
+
+        # Mostrar la latencia real y los frames descartados de cada cliente
         row_num = 1
-        for ip, delay in client_delays.items():
-            ip_label = ttk.Label(stats_window, text=ip)
-            ip_label.grid(row=row_num, column=0, padx=5, pady=2)
-            delay_label = ttk.Label(stats_window, text=f"{delay:.2f}")  # Formatear el retraso
-            delay_label.grid(row=row_num, column=1, padx=5, pady=2)
+        for client in clients:
+            values = [client['ip'], f"{client['latency_ms']:.2f}", f"{client['fps']:.1f}",
+                      str(client['drops']), f"{client['bytes_queued'] / 1024:.0f}"]
+            labels = rows.get(client['id'])
+            if labels is None:
+                labels = rows[client['id']] = [ttk.Label(stats_window) for _ in headers]
+            for column, (label, text) in enumerate(zip(labels, values)):
+                label.config(text=text)
+                label.grid(row=row_num, column=column, padx=5, pady=2)
             row_num += 1
+
+        # Ritmo de captura, costo de codificación y profundidad de las colas del pipeline
+        if encode_pipeline is not None:
+            pipeline_stats = encode_pipeline.stats()
+            snapshot = metrics.snapshot()
+            pipeline_label.config(text=(
+                f"Captura: {snapshot['scam_capture_fps']:.1f} fps | "
+                f"Codificación: {pipeline_stats['encode_ms']} ms | "
+                f"Cola de captura: {pipeline_stats['capture_queue']} | "
+                f"Reordenamiento: {pipeline_stats['reorder_pending']} | "
+                f"Variantes: {pipeline_stats['renditions']} | "
+                f"Descartados: {pipeline_stats['dropped']} | "
+                f"Sin cambios: {pipeline_stats['unchanged']}"))
+            pipeline_label.grid(row=row_num, column=0, columnspan=len(headers), padx=5, pady=2)
         stats_window.after(STATS_UPDATE_INTERVAL, update_stats)  # Actualizar con intervalo
 
     update_stats()  # Iniciar la actualización periódica
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SCam: transmisión de cámara o pantalla en la red local.")
+    parser.add_argument('--headless', action='store_true',
+                        help="Sin interfaz gráfica ni ícono de bandeja (modo servicio); los errores van al log")
+    parser.add_argument('--port', type=int, default=5000, help="Puerto de transmisión (por defecto 5000)")
+    parser.add_argument('--source', action='append', metavar='[ID=]FUENTE',
+                        help="Fuente: índice de cámara, camera:N, screen[:monitor[:x,y,ancho,alto]][@fps], "
+                             "file:ruta, synthetic[:ANCHOxALTO][@fps] o relay:URL (el /video de otra instancia). Se puede repetir: la primera se sirve "
+                             "en /video y cada una en /video/<id> (por defecto el id es su posición: 0, 1, ...)")
+    parser.add_argument('--server', choices=SERVER_MODES, default='flask', help="Servidor HTTP")
+    parser.add_argument('--capture', choices=CAPTURE_MODES, default='thread',
+                        help="'process' captura y codifica en otro proceso y comparte los frames por memoria compartida")
+    parser.add_argument('--attach-ring', metavar='NOMBRE',
+                        help="Servir los frames de un anillo compartido ya creado por otra instancia")
+    parser.add_argument('--low-latency', action=argparse.BooleanOptionalAction, default=LOW_LATENCY_CAPTURE,
+                        help="Leer siempre el frame más reciente de la cámara en lugar del buffer del driver")
+    parser.add_argument('--record', metavar='CARPETA',
+                        help="Grabar los frames en disco para verlos después en /replay?from=-60")
+    parser.add_argument('--record-quota', type=int, default=RECORD_QUOTA // 2 ** 20, metavar='MB',
+                        help="Espacio máximo en disco de la grabación, en MB")
+    parser.add_argument('--workers', type=int, default=ENCODER_WORKERS, help="Hilos codificadores JPEG")
+    parser.add_argument('--quality', type=int, default=JPEG_QUALITY, help="Calidad JPEG por defecto")
+    parser.add_argument('--log-format', choices=('text', 'json'), default='text',
+                        help="Formato del log: texto o una línea JSON por mensaje")
+    parser.add_argument('--ttff-budget', type=float, default=TTFF_BUDGET,
+                        help="Segundos permitidos hasta el primer frame antes de advertir")
+    args = parser.parse_args(argv)
+
+    # Loguear sólo encola: la escritura corre en el hilo del listener, fuera del camino de los frames
+    log_listener = setup_logging(json_lines=args.log_format == 'json')
+    try:
+        return start_from_args(args)
+    finally:
+        log_listener.stop()
+
+def start_from_args(args):
+    global ENCODER_WORKERS, ENCODE_QUEUE_SIZE, JPEG_QUALITY, TTFF_BUDGET, LOW_LATENCY_CAPTURE
+    global RECORD_DIRECTORY, RECORD_QUOTA
+    if not args.headless:
+        gui()
+        return EXIT_OK
+
+    if not (1024 <= args.port <= 65535):
+        logging.error("El puerto debe estar entre 1024 y 65535.")
+        return EXIT_USAGE
+    ENCODER_WORKERS = max(1, args.workers)
+    ENCODE_QUEUE_SIZE = ENCODER_WORKERS * 2
+    JPEG_QUALITY = args.quality
+    TTFF_BUDGET = args.ttff_budget
+    LOW_LATENCY_CAPTURE = args.low_latency
+    RECORD_DIRECTORY = args.record
+    RECORD_QUOTA = args.record_quota * 2 ** 20
+
+    # Detener la captura limpiamente con Ctrl+C o cuando el servicio recibe SIGTERM
+    signal.signal(signal.SIGINT, stop_on_signal)
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    sources = [parse_source_arg(value, position) for position, value in enumerate(args.source or ['0'])]
+    (source_id, source), extra_sources = sources[0], sources[1:]
+    if len({source_id for source_id, _ in sources}) != len(sources):
+        logging.error("Los ids de las fuentes deben ser distintos.")
+        return EXIT_USAGE
+    return start_server(args.port, source, args.server, args.capture, args.attach_ring, source_id, extra_sources)
+
 if __name__ == "__main__":
-    gui()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,424 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import struct
+from urllib.parse import urlsplit, parse_qs
+
+from fmp4 import FragmentCursor
+from hub import multipart_chunks
+from recorder import ReplayClock, parse_replay_start
+
+MAX_HEADER_SIZE = 16384  # Tamaño máximo de la línea de petición más las cabeceras
+MAX_BODY_SIZE = 65536  # Tamaño máximo del cuerpo de un POST (p. ej. /log)
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+               503: 'Service Unavailable'}
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_BINARY = 0x2
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+
+
+class _HubBridge:
+    """Traspasa las publicaciones de un FrameHub (hilo de captura) al event loop.
+
+    Se registra una sola vez por hub: cada frame nuevo programa un único
+    call_soon_threadsafe que despierta a todos los clientes que esperan.
+    """
+
+    def __init__(self, loop, hub):
+        self.loop = loop
+        self.hub = hub
+        self.clients = 0
+        self._waiters = []
+        hub.add_listener(self._on_publish)
+
+    def _on_publish(self, frame):
+        try:
+            self.loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            pass  # El loop ya se cerró
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+    async def wait(self, last_seq, timeout):
+        frame = self.hub.latest()
+        if self.hub.closed:
+            return None
+        if frame is not None and frame.seq > last_seq:
+            return frame
+        future = self.loop.create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            return None
+        frame = self.hub.latest()
+        if self.hub.closed or frame is None or frame.seq <= last_seq:
+            return None
+        return frame
+
+    def detach(self):
+        self.hub.remove_listener(self._on_publish)
+        self._wake()
+
+
+class AsyncStreamServer:
+    """Servidor HTTP mínimo sobre asyncio con las mismas rutas que el servidor Flask.
+
+    Todas las conexiones MJPEG se atienden desde un único event loop en vez
+    de un hilo por cliente; los frames llegan desde los FrameHub del
+    RenditionSet a través de _HubBridge. El buffer de escritura de cada
+    conexión se limita a max_client_buffer bytes: un cliente lento espera a
+    que su socket drene y luego salta directamente al frame más nuevo.
+    """
+
+    def __init__(self, renditions, pages, on_client_log, client_registry, on_frame_sent=None, stats=None,
+                 controller_factory=None, tile_stream=None, is_running=None, frame_timeout=1.0,
+                 max_client_buffer=256 * 1024, metrics=None, recorder=None, sources=None, mp4_stream=None,
+                 on_client_report=None):
+        self.renditions = renditions
+        self.pages = {path: html.encode('utf-8') for path, html in pages.items()}
+        self.tile_stream = tile_stream
+        self.on_client_log = on_client_log
+        self.on_client_report = on_client_report
+        self.client_registry = client_registry
+        self.on_frame_sent = on_frame_sent
+        self.stats = stats or (lambda: {'clients': client_registry.snapshot()})
+        self.controller_factory = controller_factory
+        self.metrics = metrics
+        self.recorder = recorder
+        self.mp4_stream = mp4_stream
+        self.sources = sources if sources is not None else {}  # id -> RenditionSet de cada fuente en /video/<id>
+        self.max_client_buffer = max_client_buffer
+        self.is_running = is_running or (lambda: True)
+        self.frame_timeout = frame_timeout
+        self._loop = None
+        self._bridges = {}
+
+    def run(self, host, port):
+        asyncio.run(self._main(host, port))
+
+    async def _main(self, host, port):
+        self._loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._handle, host, port, reuse_address=True, backlog=1024,
+                                            limit=MAX_HEADER_SIZE)
+        async with server:
+            while self.is_running():
+                await asyncio.sleep(0.5)
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, query, headers = await self._read_request(reader)
+            if path in self.pages:
+                await self._respond(writer, 200, 'text/html; charset=utf-8', self.pages[path])
+            elif path == '/ws/tiles':
+                await self._tiles(reader, writer, headers)
+            elif path == '/video':
+                await self._stream(writer, self.renditions, query, writer.get_extra_info('peername'))
+            elif path.startswith('/video/') and path[len('/video/'):] in self.sources:
+                await self._stream(writer, self.sources[path[len('/video/'):]], query,
+                                   writer.get_extra_info('peername'))
+            elif path == '/video.mp4':
+                if self.mp4_stream is None:
+                    # Igual que el servidor Flask: el recurso existe pero ffmpeg no está instalado
+                    await self._respond(writer, 503, 'text/plain', "ffmpeg no está disponible".encode('utf-8'))
+                else:
+                    await self._mp4(writer, writer.get_extra_info('peername'))
+            elif path == '/replay' and self.recorder is not None:
+                await self._replay(writer, query)
+            elif path == '/heartbeat':
+                await self._respond_json(writer, {'status': 'ok'})
+            elif path == '/stats':
+                await self._respond_json(writer, self.stats())
+            elif path == '/metrics' and self.metrics is not None:
+                await self._respond(writer, 200, 'text/plain; version=0.0.4',
+                                    self.metrics.render_prometheus().encode('utf-8'))
+            elif path == '/metrics.json' and self.metrics is not None:
+                await self._respond_json(writer, self.metrics.snapshot())
+            elif path == '/log':
+                body = await self._read_body(reader, writer, method, headers)
+                if body is None:
+                    return
+                log_data = json.loads(body)
+                if not isinstance(log_data, dict):
+                    raise ValueError("Log inválido")
+                peer = writer.get_extra_info('peername')
+                self.on_client_log(peer[0] if peer else 'desconocido', log_data)
+                await self._respond_json(writer, {'status': 'ok'})
+            elif path == '/report' and self.on_client_report is not None:
+                body = await self._read_body(reader, writer, method, headers)
+                if body is None:
+                    return
+                report = json.loads(body)
+                if not isinstance(report, dict):
+                    raise ValueError("Informe inválido")
+                peer = writer.get_extra_info('peername')
+                self.on_client_report(peer[0] if peer else 'desconocido', report)
+                await self._respond_json(writer, {'status': 'ok'})
+            else:
+                await self._respond(writer, 404, 'text/plain', b'Not Found')
+        except (ValueError, KeyError, TypeError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            await self._respond(writer, 400, 'text/plain', b'Bad Request')
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logging.error(f"Error atendiendo la petición: {e}")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        raw = await reader.readuntil(b'\r\n\r\n')
+        lines = raw.decode('latin-1').split('\r\n')
+        method, target, _ = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return method.upper(), url.path, query, headers
+
+    async def _read_body(self, reader, writer, method, headers):
+        # Cuerpo de un POST, o None si ya se respondió con un error
+        if method != 'POST':
+            await self._respond(writer, 405, 'text/plain', b'')
+            return None
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY_SIZE:
+            await self._respond(writer, 413, 'text/plain', b'')
+            return None
+        return await reader.readexactly(length)
+
+    async def _respond(self, writer, status, content_type, body):
+        writer.write((f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                      f"Content-Type: {content_type}\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Connection: close\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def _respond_json(self, writer, data):
+        await self._respond(writer, 200, 'application/json', json.dumps(data).encode('utf-8'))
+
+    async def _mp4(self, writer, peer):
+        # Fragmentos H.264 compartidos por todos los clientes; cada uno empieza en un keyframe
+        stream = self.mp4_stream
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: video/mp4\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        await writer.drain()
+        writer.transport.set_write_buffer_limits(high=self.max_client_buffer)
+        cursor = FragmentCursor()
+        stream.subscribe()
+        bridge = self._attach(stream.hub)
+        client = self.client_registry.register(peer[0] if peer else 'desconocido', ('h264', stream.bitrate))
+        try:
+            while self.is_running():
+                frame = await bridge.wait(cursor.last_seq, self.frame_timeout)
+                if frame is None:
+                    if stream.hub.closed:
+                        break
+                    continue
+                chunks = cursor.accept(frame)
+                if not chunks:
+                    continue
+                sent = frame._replace(data=chunks[-1])
+                client.begin_frame(sent, writer.transport.get_write_buffer_size())
+                writer.writelines(chunks)
+                await writer.drain()
+                client.end_frame(sent, writer.transport.get_write_buffer_size())
+        finally:
+            self.client_registry.unregister(client)
+            self._detach(stream.hub)
+            stream.unsubscribe()
+
+    async def _replay(self, writer, query):
+        # Frames grabados tal cual están en disco, al ritmo con que se grabaron
+        start = parse_replay_start(query.get('from', '-60'))
+        clock = ReplayClock(float(query.get('speed', 1)))
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        await writer.drain()
+        for timestamp, data in self.recorder.frames(start):
+            if not self.is_running():
+                break
+            delay = clock.delay(timestamp)
+            if delay:
+                await asyncio.sleep(delay)
+            writer.writelines(multipart_chunks(data))
+            await writer.drain()
+
+    async def _stream(self, writer, renditions, query, peer):
+        client_ip = peer[0] if peer else 'desconocido'
+        try:
+            requested = renditions.normalize(_int_arg(query, 'w'), _int_arg(query, 'q'))
+        except ValueError:
+            requested = renditions.default_key
+        controller = self.controller_factory(renditions, query) if self.controller_factory else None
+        if controller is not None:
+            requested = controller.key
+        rendition, hub = renditions.subscribe(requested)
+        if controller is not None:
+            controller.sync(rendition)
+        client = self.client_registry.register(client_ip, rendition)
+        bridge = self._attach(hub)
+        transport = writer.transport
+        transport.set_write_buffer_limits(high=self.max_client_buffer)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            await writer.drain()
+            last_seq = 0
+            while self.is_running():
+                frame = await bridge.wait(last_seq, self.frame_timeout)
+                if frame is None:
+                    if hub.closed:
+                        break
+                    continue
+                last_seq = frame.seq
+                client.begin_frame(frame, transport.get_write_buffer_size())
+                # Parte multipart compartida por todas las conexiones, sin concatenar
+                writer.writelines(frame.chunks)
+                # drain() sólo bloquea si el buffer superó el límite; mientras tanto se publican
+                # frames nuevos y al volver se envía directamente el más reciente
+                await writer.drain()
+                client.end_frame(frame, transport.get_write_buffer_size())
+                if self.on_frame_sent is not None:
+                    self.on_frame_sent(client)
+                if controller is not None:
+                    new_rendition = controller.update(client)
+                    if new_rendition is not None and new_rendition != rendition:
+                        # Suscribir antes de soltar la actual: la variante servida puede ser la misma
+                        served, served_hub = renditions.subscribe(new_rendition)
+                        renditions.unsubscribe(rendition)
+                        controller.sync(served)
+                        if served != rendition:
+                            self._detach(hub)
+                            rendition, hub = served, served_hub
+                            bridge = self._attach(hub)
+                            client.switch_rendition(rendition)
+                            last_seq = 0
+        finally:
+            self._detach(hub)
+            self.client_registry.unregister(client)
+            renditions.unsubscribe(rendition)
+
+    async def _tiles(self, reader, writer, headers):
+        stream = self.tile_stream
+        key = headers.get('sec-websocket-key')
+        if stream is None or headers.get('upgrade', '').lower() != 'websocket' or not key:
+            await self._respond(writer, 400, 'text/plain', b'Bad Request')
+            return
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                     b"Upgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + websocket_accept(key).encode('latin-1') + b"\r\n\r\n")
+        await writer.drain()
+        writer.transport.set_write_buffer_limits(high=self.max_client_buffer)
+        stream.subscribe()
+        bridge = self._attach(stream.hub)
+        closed = asyncio.Event()
+        incoming = asyncio.ensure_future(self._websocket_incoming(reader, writer, closed))
+        try:
+            last_seq = 0
+            while self.is_running() and not closed.is_set():
+                frame = await bridge.wait(last_seq, self.frame_timeout)
+                if frame is None:
+                    if stream.hub.closed:
+                        break
+                    continue
+                last_seq, data = stream.message_for(frame, last_seq)
+                writer.writelines((websocket_header(len(data)), data))
+                await writer.drain()
+        finally:
+            incoming.cancel()
+            self._detach(stream.hub)
+            stream.unsubscribe()
+
+    async def _websocket_incoming(self, reader, writer, closed):
+        # El cliente no envía datos, pero hay que contestar pings y detectar el cierre
+        try:
+            while True:
+                opcode, payload = await read_websocket_frame(reader)
+                if opcode == WS_CLOSE:
+                    writer.write(websocket_frame(payload[:2], WS_CLOSE))
+                    break
+                if opcode == WS_PING:
+                    writer.write(websocket_frame(payload, WS_PONG))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            closed.set()
+
+    def _attach(self, hub):
+        bridge = self._bridges.get(hub)
+        if bridge is None:
+            bridge = self._bridges[hub] = _HubBridge(self._loop, hub)
+        bridge.clients += 1
+        return bridge
+
+    def _detach(self, hub):
+        bridge = self._bridges.get(hub)
+        if bridge is not None:
+            bridge.clients -= 1
+            if bridge.clients <= 0:
+                bridge.detach()
+                del self._bridges[hub]
+
+
+def websocket_accept(key):
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode('latin-1')).digest()
+    return base64.b64encode(digest).decode('latin-1')
+
+
+def websocket_header(length, opcode=WS_BINARY):
+    if length < 126:
+        return struct.pack('!BB', 0x80 | opcode, length)
+    if length < 65536:
+        return struct.pack('!BBH', 0x80 | opcode, 126, length)
+    return struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+
+def websocket_frame(payload, opcode=WS_BINARY):
+    return websocket_header(len(payload), opcode) + payload
+
+
+async def read_websocket_frame(reader):
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > MAX_BODY_SIZE:
+        raise ValueError("Mensaje WebSocket demasiado grande")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+def _int_arg(query, name):
+    # Como request.args.get(name, type=int) en Flask: None si falta o no es un entero
+    try:
+        return int(query[name])
+    except (KeyError, ValueError):
+        return None
@@ -0,0 +1,314 @@
+"""Benchmark de SCam: levanta el servidor con una fuente sintética o un archivo
+de video y mide lo que reciben N clientes MJPEG simulados.
+
+Ejemplo:
+    python bench.py --clients 20 --resolution 1280x720 --fps 30 --duration 20 --server async
+
+El resultado es un JSON (por stdout o en --output) con los FPS entregados a
+cada cliente, percentiles de antigüedad de los frames, CPU y memoria del
+servidor y bytes por segundo.
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from hub import read_multipart_part
+
+STARTUP_TIMEOUT = 15.0  # Segundos para que el servidor responda en /heartbeat
+SAMPLE_INTERVAL = 0.5  # Segundos entre muestras de CPU y memoria del servidor
+
+
+class MjpegClient:
+    """Cliente /video simulado: lee las partes multipart y registra cada frame.
+
+    Lee cada parte con hub.read_multipart_part() (el JPEG con su
+    Content-Length, sin buscar el boundary) y usa X-Timestamp (instante de captura en time.monotonic del
+    servidor, que en el mismo equipo es el mismo reloj) para medir la
+    antigüedad del frame al terminar de recibirlo.
+    """
+
+    def __init__(self, host, port, path):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.frames = 0
+        self.bytes = 0
+        self.ages = []  # Antigüedad de cada frame recibido durante la medición (s)
+        self.error = None
+        self.measuring = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=10)
+        try:
+            connection.request('GET', self.path)
+            stream = connection.getresponse()
+            if stream.status != 200:
+                raise ValueError(f"HTTP {stream.status}")
+            while not self._stop.is_set():
+                part = read_multipart_part(stream)
+                if part is None:
+                    break
+                headers, data = part
+                received = time.monotonic()
+                if self.measuring:
+                    self.frames += 1
+                    self.bytes += len(data)
+                    if 'x-timestamp' in headers:
+                        self.ages.append(received - float(headers['x-timestamp']))
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            if not self._stop.is_set():
+                self.error = str(e)
+        finally:
+            connection.close()
+
+    def result(self, duration):
+        return {
+            'frames': self.frames,
+            'fps': round(self.frames / duration, 2),
+            'bytes_per_s': round(self.bytes / duration),
+            'age_ms': _percentiles(self.ages),
+            'error': self.error,
+        }
+
+
+def _percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': round(ordered[-1] * 1000, 1)}
+
+
+class ProcessMonitor:
+    """Muestrea el uso de CPU y memoria de un proceso y de sus hijos mientras dura la medición.
+
+    Los hijos cuentan porque con --capture process la captura y la
+    codificación corren en otro proceso. Usa psutil si está instalado y si
+    no lee /proc (Linux).
+    """
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._cpu_start = None
+        self._wall_start = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except ImportError:
+            self._process = None
+
+    def start(self):
+        self._cpu_start = self._cpu_time()
+        self._wall_start = time.monotonic()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        wall = time.monotonic() - self._wall_start
+        cpu = self._cpu_time()
+        cpu_percent = None
+        if cpu is not None and self._cpu_start is not None and wall > 0:
+            cpu_percent = round((cpu - self._cpu_start) / wall * 100, 1)
+        return {'cpu_percent': cpu_percent, 'peak_rss_mb': round(self.peak_rss / 2 ** 20, 1) or None}
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self._rss()
+            if rss:
+                self.peak_rss = max(self.peak_rss, rss)
+
+    def _processes(self):
+        # El proceso y todos sus descendientes vivos
+        if self._process is not None:
+            return [self._process] + self._process.children(recursive=True)
+        parents = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    parents.setdefault(int(_proc_stat(entry)[1]), []).append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue  # Terminó mientras se recorría /proc
+        pids = [self.pid]
+        for pid in pids:
+            pids.extend(parents.get(pid, ()))
+        return pids
+
+    def _cpu_time(self):
+        # Incluye el CPU de los hijos ya terminados (children_*, cutime y cstime) para no perderlo
+        try:
+            total = 0.0
+            for process in self._processes():
+                try:
+                    if self._process is not None:
+                        times = process.cpu_times()
+                        total += times.user + times.system + times.children_user + times.children_system
+                    else:
+                        fields = _proc_stat(process)
+                        total += sum(int(field) for field in fields[11:15]) / os.sysconf('SC_CLK_TCK')
+                except Exception:
+                    if process in (self._process, self.pid):
+                        raise
+            return total
+        except Exception:
+            return None
+
+    def _rss(self):
+        try:
+            total = 0
+            for process in self._processes():
+                try:
+                    if self._process is not None:
+                        total += process.memory_info().rss
+                        continue
+                    with open(f'/proc/{process}/status') as file:
+                        for line in file:
+                            if line.startswith('VmRSS:'):
+                                total += int(line.split()[1]) * 1024
+                except Exception:
+                    if process in (self._process, self.pid):
+                        raise
+            return total
+        except Exception:
+            return None
+
+
+def _proc_stat(pid):
+    # Campos de /proc/PID/stat después del nombre del proceso (que puede tener espacios)
+    with open(f'/proc/{pid}/stat') as file:
+        return file.read().rsplit(')', 1)[1].split()
+
+
+def wait_for_server(port, process, timeout=STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/heartbeat', timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def fetch_json(port, path):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=2) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+
+def run(args):
+    source = args.source or f'synthetic:{args.resolution}@{args.fps}'
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'), '--headless',
+               '--port', str(args.port), '--source', source, '--server', args.server, '--capture', args.capture]
+    if args.workers:
+        command += ['--workers', str(args.workers)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                              stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        if not wait_for_server(args.port, server):
+            return {'error': f"El servidor no respondió en el puerto {args.port}"}
+
+        path = '/video' + (f'?{args.query}' if args.query else '')
+        clients = [MjpegClient('127.0.0.1', args.port, path) for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        time.sleep(args.warmup)  # Dejar que arranquen los encoders y se llenen los buffers
+
+        monitor = ProcessMonitor(server.pid)
+        for client in clients:
+            client.measuring = True
+        monitor.start()
+        started = time.monotonic()
+        time.sleep(args.duration)
+        for client in clients:
+            client.measuring = False
+        duration = time.monotonic() - started
+        usage = monitor.stop()
+        server_metrics = fetch_json(args.port, '/metrics.json')
+
+        for client in clients:
+            client.stop()
+        per_client = [client.result(duration) for client in clients]
+        all_ages = [age for client in clients for age in client.ages]
+        fps = [result['fps'] for result in per_client]
+        return {
+            'config': {'source': source, 'server': args.server, 'capture': args.capture, 'clients': args.clients,
+                       'duration_s': round(duration, 2), 'query': args.query},
+            'fps': {'min': min(fps), 'avg': round(sum(fps) / len(fps), 2), 'max': max(fps)} if fps else None,
+            'age_ms': _percentiles(all_ages),
+            'bytes_per_s': sum(result['bytes_per_s'] for result in per_client),
+            'server': usage,
+            'errors': sum(1 for result in per_client if result['error']),
+            'clients': per_client,
+            'server_metrics': server_metrics,
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de SCam con clientes MJPEG simulados.")
+    parser.add_argument('--clients', type=int, default=10, help="Clientes /video simultáneos")
+    parser.add_argument('--resolution', default='1280x720', help="Resolución del patrón de prueba (ANCHOxALTO)")
+    parser.add_argument('--fps', type=float, default=30, help="FPS del patrón de prueba")
+    parser.add_argument('--source', help="Otra fuente en lugar del patrón de prueba, p. ej. file:video.mp4")
+    parser.add_argument('--server', choices=('flask', 'async'), default='async', help="Servidor HTTP a medir")
+    parser.add_argument('--capture', choices=('thread', 'process'), default='thread', help="Modo de captura")
+    parser.add_argument('--workers', type=int, help="Hilos codificadores JPEG del servidor")
+    parser.add_argument('--query', default='', help="Parámetros de /video, p. ej. w=640&q=60")
+    parser.add_argument('--port', type=int, default=5099, help="Puerto del servidor bajo prueba")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Segundos antes de empezar a medir")
+    parser.add_argument('--duration', type=float, default=10.0, help="Segundos de medición")
+    parser.add_argument('--min-fps', type=float,
+                        help="Terminar con código 1 si algún cliente recibe menos FPS (para CI)")
+    parser.add_argument('--output', help="Guardar el JSON en este archivo en lugar de imprimirlo")
+    parser.add_argument('--verbose', action='store_true', help="Mostrar el log del servidor")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+    if 'error' in result:
+        return 2
+    if args.min_fps is not None and result['fps'] and result['fps']['min'] < args.min_fps:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+
+
+class CaptureStage:
+    """Captura de una fuente en un hilo propio, que entrega los frames a su EncodePipeline.
+
+    Cada fuente servida en /video/<id> tiene su etapa de captura, su
+    RenditionSet y su EncodePipeline; los encoders se comparten entre todas
+    a través de un EncodePool. Si nadie mira la fuente durante idle_timeout
+    segundos se libera el dispositivo y el hilo duerme en
+    RenditionSet.wait_watched() hasta que se suscribe un cliente, así una
+    fuente sin clientes casi no consume CPU (idle_timeout 0 no la libera).
+    watched indica si hay clientes cuando, además de las variantes JPEG,
+    hay otros consumidores de los frames (tiles, MP4); on_first_frame se
+    llama una vez con el primer frame capturado. wait_available() devuelve
+    si el primer intento de abrir y leer la fuente funcionó: la fuente sólo
+    se toca desde el hilo de captura, también para comprobarla. Si el hilo
+    termina por un error inesperado, queda en error y is_alive() pasa a ser
+    falso.
+    """
+
+    def __init__(self, source_id, source, renditions, pipeline, idle_timeout=10.0, retry_interval=5.0,
+                 low_latency=True, watched=None, on_first_frame=None):
+        self.source_id = source_id
+        self.source = source
+        self.renditions = renditions
+        self.pipeline = pipeline
+        self.idle_timeout = idle_timeout
+        self.retry_interval = retry_interval
+        self.low_latency = low_latency
+        self.watched = watched or renditions.watched
+        self.on_first_frame = on_first_frame
+        self.frames = 0
+        self.idle = False
+        self.error = None
+        self.available = None  # Resultado del primer intento de abrir y leer la fuente
+        self._checked = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"capture-{self.source_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.retry_interval)
+        self.pipeline.close()
+        self.renditions.close()
+        self.source.close()
+
+    def wait_available(self, timeout=None):
+        self._checked.wait(timeout)
+        return self.available
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        return {'name': self.source.name, 'idle': self.idle, 'frames': self.frames,
+                'pipeline': self.pipeline.stats()}
+
+    def _run(self):
+        try:
+            self._capture()
+        except Exception as e:
+            logging.exception(f"Error inesperado en la captura de {self.source.name}")
+            self.error = e
+            self._check(False)
+
+    def _capture(self):
+        unwatched_since = None
+        while not self._stop.is_set():
+            if self.watched():
+                unwatched_since = None
+            elif self.idle_timeout:
+                now = time.monotonic()
+                if unwatched_since is None:
+                    unwatched_since = now
+                if now - unwatched_since >= self.idle_timeout:
+                    if not self.idle:
+                        logging.info(f"Sin clientes en /video/{self.source_id}: se libera {self.source.name}")
+                        self.source.close()
+                        self.idle = True
+                    self.renditions.wait_watched(timeout=1.0)
+                    continue
+            if not self.source.is_opened():
+                try:
+                    opened = self.source.open()
+                except Exception as e:
+                    logging.error(f"Error al abrir {self.source.name}: {e}")
+                    opened = False
+                if not opened:
+                    logging.error(f"No se pudo abrir {self.source.name}. Intentando de nuevo...")
+                    self._check(False)
+                    self.source.close()
+                    self._stop.wait(self.retry_interval)
+                    continue
+                if self.idle:
+                    logging.info(f"Reanudando la captura de {self.source.name}")
+                self.idle = False
+            if self.low_latency:
+                self.pipeline.wait_ready(1.0)
+            try:
+                ok, frame = self.source.read()
+            except Exception as e:
+                logging.error(f"Error durante la captura de {self.source.name}: {e}")
+                ok = False
+            if not ok:
+                logging.error(f"Error al capturar el frame de {self.source.name}")
+                self._check(False)
+                self.source.close()
+                self._stop.wait(self.retry_interval)
+                continue
+            self.frames += 1
+            if self.frames == 1:
+                self._check(True)
+                if self.on_first_frame is not None:
+                    self.on_first_frame()
+            self.pipeline.submit(frame, self.source.timestamp)
+
+    def _check(self, available):
+        # Sólo cuenta el primer intento; los siguientes son reintentos de la captura
+        if not self._checked.is_set():
+            self.available = available
+            self._checked.set()
@@ -0,0 +1,279 @@
+import itertools
+import math
+import threading
+import time
+
+from metrics import LATENCY_BUCKETS, MetricsRegistry
+
+EWMA_ALPHA = 0.2  # Peso de la última muestra en los promedios móviles
+
+# Escalones (ancho, calidad) del control adaptativo, de mayor a menor costo; ancho 0 = resolución original
+QUALITY_LADDER = ((0, 70), (0, 50), (0, 30), (960, 30), (640, 30), (480, 25), (320, 20))
+DOWN_LOAD = 0.9  # Fracción del presupuesto por frame gastada escribiendo a partir de la cual se baja la calidad
+UP_LOAD = 0.5  # Por debajo de esta fracción hay margen para subir la calidad
+
+
+class ClientStats:
+    """Contabilidad del lado de envío de una conexión /video.
+
+    begin_frame() se llama justo antes de escribir un frame en el socket y
+    end_frame() cuando la escritura terminó, de modo que la latencia medida
+    incluye el tiempo que el socket tardó en drenar y no sólo el intervalo
+    entre frames.
+    """
+
+    def __init__(self, client_id, ip, rendition, metrics=None):
+        self.client_id = client_id
+        self.ip = ip
+        self.rendition = rendition
+        self.connected_at = time.monotonic()
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.drops = 0  # Frames publicados que el cliente se saltó por ir atrasado
+        self.bytes_queued = 0  # Bytes escritos que todavía no salieron por el socket
+        self.last_seq = 0
+        self.last_write_time = None  # Instante (monotonic) en que terminó de escribirse el último frame
+        self.write_time = 0.0  # Duración promedio de la escritura de un frame (s)
+        self.frame_age = 0.0  # Antigüedad del frame al empezar a enviarlo (ms)
+        self.latency = 0.0  # Desde la captura del frame hasta terminar de enviarlo (glass-to-wire, ms)
+        self.fps = 0.0
+        self.last_delay_log = None  # Instante (monotonic) del último log de retraso de este cliente
+        self._write_started = None
+        metrics = metrics or MetricsRegistry()
+        self._sent_total = metrics.counter('scam_frames_sent_total', "Frames enviados a todos los clientes")
+        self._bytes_total = metrics.counter('scam_bytes_sent_total', "Bytes de JPEG enviados a todos los clientes")
+        self._drops_total = metrics.counter('scam_client_drops_total',
+                                            "Frames que los clientes se saltaron por ir atrasados")
+        self._age_seconds = metrics.histogram('scam_frame_age_seconds',
+                                              "Antigüedad del frame al terminar de enviarlo (glass-to-wire)",
+                                              LATENCY_BUCKETS)
+
+    def begin_frame(self, frame, bytes_queued=0):
+        now = time.monotonic()
+        if self.last_seq:
+            skipped = max(0, frame.seq - self.last_seq - 1)
+            if skipped:
+                self.drops += skipped
+                self._drops_total.inc(skipped)
+        self.last_seq = frame.seq
+        self.bytes_queued = bytes_queued + len(frame.data)
+        self.frame_age = (now - frame.timestamp) * 1000
+        self._write_started = now
+
+    def end_frame(self, frame, bytes_queued=0):
+        now = time.monotonic()
+        self.frames_sent += 1
+        self.bytes_sent += len(frame.data)
+        self.bytes_queued = bytes_queued
+        self.latency = (now - frame.timestamp) * 1000
+        self._sent_total.inc()
+        self._bytes_total.inc(len(frame.data))
+        self._age_seconds.observe(now - frame.timestamp)
+        self.write_time = _ewma(self.write_time, now - self._write_started)
+        if self.last_write_time is not None:
+            interval = now - self.last_write_time
+            if interval > 0:
+                self.fps = _ewma(self.fps, 1.0 / interval)
+        self.last_write_time = now
+
+    def switch_rendition(self, rendition):
+        # Los números de secuencia son propios de cada variante, y las medidas previas ya no aplican
+        self.rendition = rendition
+        self.last_seq = 0
+        self.write_time = 0.0
+
+    def snapshot(self):
+        return {
+            'id': self.client_id,
+            'ip': self.ip,
+            'rendition': list(self.rendition),
+            'frames_sent': self.frames_sent,
+            'bytes_sent': self.bytes_sent,
+            'bytes_queued': self.bytes_queued,
+            'drops': self.drops,
+            'fps': round(self.fps, 1),
+            'frame_age_ms': round(self.frame_age, 1),
+            'latency_ms': round(self.latency, 1),
+            'write_ms': round(self.write_time * 1000, 1),
+        }
+
+
+class QualityController:
+    """Control en lazo cerrado de la variante (ancho, calidad) de un cliente.
+
+    La carga es la fracción del intervalo entre frames (1 / target_fps) que
+    el cliente tarda en escribir un frame: si el enlace no alcanza o la
+    latencia se dispara se baja un escalón, y si la carga se mantiene baja
+    durante up_hold segundos se sube uno. Si start no es un escalón se
+    arranca en el más cercano; sync() alinea el escalón con la variante que
+    realmente se está sirviendo.
+    """
+
+    def __init__(self, ladder=QUALITY_LADDER, start=None, target_fps=15, max_latency=500.0,
+                 down_hold=1.0, up_hold=5.0):
+        self.ladder = ladder
+        self.index = _nearest_rung(ladder, start) if start is not None else len(ladder) // 2
+        self.target_fps = target_fps
+        self.max_latency = max_latency
+        self.down_hold = down_hold
+        self.up_hold = up_hold
+        self._changed_at = time.monotonic()
+        self._calm_since = None
+
+    @property
+    def key(self):
+        return self.ladder[self.index]
+
+    def sync(self, key):
+        # RenditionSet.subscribe() puede servir otra variante que la pedida (p. ej. la de por defecto)
+        self.index = _nearest_rung(self.ladder, key)
+
+    def update(self, client):
+        # Devuelve la nueva variante si hay que cambiar, o None
+        now = time.monotonic()
+        load = client.write_time * self.target_fps
+        if load > DOWN_LOAD or client.latency > self.max_latency:
+            self._calm_since = None
+            if self.index < len(self.ladder) - 1 and now - self._changed_at >= self.down_hold:
+                return self._step(1, now)
+        elif load < UP_LOAD:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif self.index > 0 and now - self._calm_since >= self.up_hold and now - self._changed_at >= self.up_hold:
+                self._calm_since = now
+                return self._step(-1, now)
+        else:
+            self._calm_since = None
+        return None
+
+    def _step(self, direction, now):
+        self.index += direction
+        self._changed_at = now
+        return self.key
+
+
+class ClientRegistry:
+    """Clientes conectados; con metrics exporta además una serie por cliente.
+
+    Las series por cliente se arman en cada consulta a partir de los
+    clientes registrados, así que las de un cliente desconectado
+    desaparecen apenas se llama a unregister().
+    """
+
+    def __init__(self, metrics=None):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._ids = itertools.count(1)
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.add_collector(self._collect)
+
+    def register(self, ip, rendition):
+        with self._lock:
+            client = ClientStats(next(self._ids), ip, rendition, self.metrics)
+            self._clients[client.client_id] = client
+            return client
+
+    def unregister(self, client):
+        with self._lock:
+            self._clients.pop(client.client_id, None)
+
+    def clients(self):
+        with self._lock:
+            return list(self._clients.values())
+
+    def snapshot(self):
+        return [client.snapshot() for client in self.clients()]
+
+    def _collect(self):
+        clients = self.clients()
+        labels = {client: {'client': str(client.client_id), 'ip': client.ip,
+                           'rendition': '{}x{}'.format(*client.rendition)} for client in clients}
+        return [
+            ('scam_clients_connected', 'gauge', "Clientes conectados a /video", [({}, len(clients))]),
+            ('scam_client_fps', 'gauge', "Frames por segundo enviados a cada cliente",
+             [(labels[client], round(client.fps, 2)) for client in clients]),
+            ('scam_client_frames_sent', 'gauge', "Frames enviados a cada cliente desde que se conectó",
+             [(labels[client], client.frames_sent) for client in clients]),
+            ('scam_client_drops', 'gauge', "Frames que cada cliente se saltó por ir atrasado",
+             [(labels[client], client.drops) for client in clients]),
+            ('scam_client_bytes_queued', 'gauge', "Bytes escritos a cada cliente que todavía no salieron",
+             [(labels[client], client.bytes_queued) for client in clients]),
+            ('scam_client_frame_age_seconds', 'gauge', "Antigüedad del último frame enviado a cada cliente",
+             [(labels[client], client.latency / 1000) for client in clients]),
+        ]
+
+
+class ViewerReports:
+    """Lo que informa cada navegador por /report: FPS decodificados y frames descartados.
+
+    Complementa a ClientRegistry, que sólo ve el lado de envío: un cliente
+    puede recibir todo a tiempo y aun así no alcanzar a decodificar. Los
+    informes llegan en lotes cada pocos segundos; el de un visor que deja
+    de informar durante timeout segundos se descarta.
+    """
+
+    def __init__(self, metrics=None, timeout=30.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._viewers = {}  # (ip, id del visor) -> (instante, informe)
+        if metrics is not None:
+            metrics.add_collector(self._collect)
+
+    def update(self, ip, report):
+        # Sólo se guardan los campos conocidos, con su tipo: el informe viene del navegador
+        viewer = str(report.get('viewer', ''))[:64]
+        entry = {
+            'viewer': viewer,
+            'ip': ip,
+            'fps': round(_report_number(report, 'fps'), 1),
+            'received': int(_report_number(report, 'received')),
+            'decoded': int(_report_number(report, 'decoded')),
+            'drawn': int(_report_number(report, 'drawn')),
+            'dropped': int(_report_number(report, 'dropped')),
+        }
+        with self._lock:
+            self._viewers[(ip, viewer)] = (time.monotonic(), entry)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            for key, (updated, _) in list(self._viewers.items()):
+                if now - updated > self.timeout:
+                    del self._viewers[key]
+            return [entry for _, entry in self._viewers.values()]
+
+    def _collect(self):
+        viewers = self.snapshot()
+        labels = [{'viewer': viewer['viewer'], 'ip': viewer['ip']} for viewer in viewers]
+        return [
+            ('scam_viewers', 'gauge', "Navegadores que enviaron un informe reciente a /report", [({}, len(viewers))]),
+            ('scam_viewer_decode_fps', 'gauge', "Frames por segundo que cada navegador decodificó y dibujó",
+             [(label, viewer['fps']) for label, viewer in zip(labels, viewers)]),
+            ('scam_viewer_frames_decoded', 'gauge', "Frames decodificados por cada navegador desde que cargó la página",
+             [(label, viewer['decoded']) for label, viewer in zip(labels, viewers)]),
+            ('scam_viewer_frames_dropped', 'gauge',
+             "Frames que cada navegador descartó sin dibujar por llegar otro más nuevo",
+             [(label, viewer['dropped']) for label, viewer in zip(labels, viewers)]),
+        ]
+
+def _nearest_rung(ladder, key):
+    # Índice del escalón igual a key o, si no lo hay, del de mismo ancho con la calidad más parecida
+    if key in ladder:
+        return ladder.index(key)
+    width, quality = key
+    same_width = [index for index, rung in enumerate(ladder) if rung[0] == width]
+    candidates = same_width or range(len(ladder))
+    return min(candidates, key=lambda index: (abs(ladder[index][1] - quality), index))
+
+def _report_number(report, name):
+    # Contador o tasa informado por el navegador: un número finito, y nunca negativo
+    value = float(report.get(name) or 0)
+    if not math.isfinite(value):
+        raise ValueError(f"Valor inválido para {name}")
+    return max(0.0, value)
+
+def _ewma(current, sample):
+    if not current:
+        return sample
+    return current + EWMA_ALPHA * (sample - current)
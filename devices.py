@@ -0,0 +1,154 @@
+import logging
+import os
+import re
+import sys
+import threading
+from collections import namedtuple
+
+# Dispositivo de video detectado: id estable, nombre para mostrar e índice para cv2.VideoCapture
+Device = namedtuple('Device', ['id', 'name', 'index'])
+
+SYSFS_VIDEO_ROOT = '/sys/class/video4linux'
+PROBE_MAX_INDEX = 10  # Índices a probar abriendo dispositivos cuando no hay otra forma de enumerarlos
+
+
+class DeviceRegistry:
+    """Caché de cámaras disponibles con ids estables.
+
+    La primera consulta enumera los dispositivos una sola vez; después un
+    hilo en segundo plano refresca la lista cada refresh_interval segundos
+    leyendo sólo los metadatos de los dispositivos nuevos. En Linux se usa
+    sysfs (sysfs_root) y en Windows WMI, sin abrir ningún dispositivo; sólo
+    si ninguno está disponible se recurre a abrir índices con OpenCV, y eso
+    se hace una única vez.
+    """
+
+    def __init__(self, sysfs_root=SYSFS_VIDEO_ROOT, refresh_interval=5.0, platform=None):
+        self.sysfs_root = sysfs_root
+        self.refresh_interval = refresh_interval
+        self.platform = platform or sys.platform
+        self._lock = threading.Lock()
+        self._devices = None
+        self._nodes = {}  # nodo de sysfs (p. ej. "video0") -> Device, para refrescar incrementalmente
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def devices(self):
+        with self._lock:
+            if self._devices is None:
+                self._devices = self._probe()
+            return list(self._devices)
+
+    def find(self, device_id):
+        return next((device for device in self.devices() if device.id == device_id), None)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def start(self):
+        # Refrescar en segundo plano para detectar dispositivos conectados o desconectados
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="device-registry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def refresh(self):
+        devices = self._probe()
+        with self._lock:
+            changed = devices != self._devices
+            self._devices = devices
+        if changed:
+            for listener in self._listeners:
+                listener(list(devices))
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Error al refrescar los dispositivos de video: {e}")
+
+    def _probe(self):
+        if os.path.isdir(self.sysfs_root):
+            return _unique_names(self._probe_sysfs())
+        if self.platform.startswith('win'):
+            try:
+                return _unique_names(_probe_wmi())
+            except Exception as e:
+                logging.error(f"Error listing cameras with WMI: {e}")
+        if self._devices is not None:
+            return self._devices  # Sin enumeración pasiva: no volver a abrir dispositivos
+        return _unique_names(_probe_opencv())
+
+    def _probe_sysfs(self):
+        nodes = {}
+        for node in os.listdir(self.sysfs_root):
+            match = re.fullmatch(r'video(\d+)', node)
+            if not match:
+                continue
+            device = self._nodes.get(node)
+            if device is None:
+                device = self._read_sysfs_node(node, int(match.group(1)))
+            if device is not None:
+                nodes[node] = device
+        self._nodes = nodes
+        return sorted(nodes.values(), key=lambda device: device.index)
+
+    def _read_sysfs_node(self, node, index):
+        path = os.path.join(self.sysfs_root, node)
+        # Cada cámara UVC expone varios nodos; sólo el de índice 0 captura imágenes
+        if _read_text(os.path.join(path, 'index'), '0') != '0':
+            return None
+        name = _read_text(os.path.join(path, 'name'), f"Cámara {index}")
+        device_path = os.path.join(path, 'device')
+        device_id = 'v4l:' + (os.path.realpath(device_path) if os.path.exists(device_path) else f"{name}:{node}")
+        return Device(device_id, name, index)
+
+
+def _probe_wmi():
+    import pythoncom  # Sólo existen en Windows
+    import wmi
+    # COM se inicializa por hilo: el refresco corre en el hilo del registro, no en el que lo creó
+    pythoncom.CoInitialize()
+    try:
+        devices = []
+        for device in wmi.WMI().Win32_PnPEntity():
+            if device.Name and ("camera" in device.Name.lower() or "video" in device.Name.lower()):
+                devices.append(Device('wmi:' + (device.PNPDeviceID or device.Name), device.Name, len(devices)))
+        return devices
+    finally:
+        pythoncom.CoUninitialize()
+
+
+def _probe_opencv():
+    import cv2
+    devices = []
+    for index in range(PROBE_MAX_INDEX):
+        cap = cv2.VideoCapture(index)
+        if cap.isOpened():
+            devices.append(Device(f'cv2:{index}', f"Cámara {index}", index))
+        cap.release()
+    return devices
+
+
+def _unique_names(devices):
+    # Dos cámaras del mismo modelo no deben quedar con el mismo nombre en la lista
+    seen = {}
+    unique = []
+    for device in devices:
+        count = seen.get(device.name, 0) + 1
+        seen[device.name] = count
+        unique.append(device._replace(name=f"{device.name} ({count})") if count > 1 else device)
+    return unique
+
+
+def _read_text(path, default):
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return default
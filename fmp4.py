@@ -0,0 +1,274 @@
+import logging
+import shutil
+import struct
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+from hub import FrameHub
+
+# Fragmento moof+mdat publicado en el hub: keyframe indica si un cliente nuevo puede empezar por él,
+# init es el segmento de inicialización (ftyp+moov) del proceso ffmpeg que lo generó
+Fragment = namedtuple('Fragment', ['keyframe', 'data', 'init'])
+
+BOX_HEADER = struct.Struct('>I4s')
+NON_SYNC_SAMPLE = 0x00010000  # Bit sample_is_non_sync_sample de los sample flags de ISO BMFF
+
+
+def find_ffmpeg():
+    # ffmpeg del sistema, o el que trae el paquete opcional imageio-ffmpeg
+    path = shutil.which('ffmpeg')
+    if path:
+        return path
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+class Fmp4Stream:
+    """H.264 en MP4 fragmentado, codificado una sola vez y repartido a todos los clientes.
+
+    Mientras haya suscriptores, un hilo toma los frames crudos del pipeline
+    y se los pasa a un proceso ffmpeg a ritmo constante (fps, repitiendo el
+    último si la fuente no trae uno nuevo); otro hilo separa la salida en el
+    segmento de inicialización (ftyp+moov) y un fragmento moof+mdat por
+    frame, que se publican en hub. Con un keyframe cada gop_seconds, un
+    cliente que llega tarde recibe el segmento de inicialización y empieza
+    en el próximo keyframe (ver FragmentCursor). Sin suscriptores durante
+    idle_timeout segundos se detiene ffmpeg.
+    """
+
+    def __init__(self, raw_hub, ffmpeg, fps=15, bitrate='800k', gop_seconds=1.0, preset='veryfast',
+                 idle_timeout=10.0, frame_timeout=1.0):
+        self.raw_hub = raw_hub
+        self.ffmpeg = ffmpeg
+        self.fps = fps
+        self.bitrate = bitrate
+        self.gop_seconds = gop_seconds
+        self.preset = preset
+        self.idle_timeout = idle_timeout
+        self.frame_timeout = frame_timeout
+        self.hub = FrameHub()
+        self._lock = threading.Lock()
+        self._subscribers = 0
+        self._idle_since = None
+        self._closed = False
+        self._thread = None
+
+    def subscribe(self):
+        with self._lock:
+            self._subscribers += 1
+            self._idle_since = None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="fmp4", daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self):
+        with self._lock:
+            self._subscribers = max(0, self._subscribers - 1)
+            if not self._subscribers:
+                self._idle_since = time.monotonic()
+
+    def watched(self):
+        return self._subscribers > 0
+
+    def close(self):
+        self._closed = True
+        self.hub.close()
+
+    def _run(self):
+        process = None
+        size = None
+        last_seq = 0
+        latest = None
+        interval = 1.0 / self.fps
+        next_time = time.monotonic()
+        try:
+            while not self._closed:
+                with self._lock:
+                    if not self._subscribers and time.monotonic() - self._idle_since >= self.idle_timeout:
+                        self._thread = None
+                        return
+                frame = self.raw_hub.wait(last_seq, timeout=0 if latest is not None else self.frame_timeout)
+                if frame is not None:
+                    last_seq = frame.seq
+                    latest = frame.data
+                if latest is None:
+                    if self.raw_hub.closed:
+                        return
+                    continue
+                height, width = latest.shape[:2]
+                if process is None or (width, height) != size or process.poll() is not None:
+                    self._stop_encoder(process)
+                    size = (width, height)
+                    process = self._start_encoder(width, height)
+                try:
+                    process.stdin.write(latest.data if latest.flags['C_CONTIGUOUS'] else latest.tobytes())
+                except (BrokenPipeError, OSError) as e:
+                    logging.error(f"ffmpeg dejó de aceptar frames: {e}")
+                    self._stop_encoder(process)
+                    process = None
+                    time.sleep(self.frame_timeout)
+                    continue
+                # Ritmo constante: ffmpeg recibe fps frames por segundo aunque la fuente se atrase
+                next_time += interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.monotonic()
+        finally:
+            self._stop_encoder(process)
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _start_encoder(self, width, height):
+        gop = max(1, round(self.fps * self.gop_seconds))
+        command = [
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-framerate', str(self.fps), '-i', '-',
+            '-an', '-c:v', 'libx264', '-preset', self.preset, '-tune', 'zerolatency', '-pix_fmt', 'yuv420p',
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',  # yuv420p necesita dimensiones pares
+            '-b:v', self.bitrate, '-maxrate', self.bitrate, '-bufsize', self.bitrate,
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+            '-f', 'mp4', '-movflags', 'empty_moov+default_base_moof+frag_every_frame', '-',
+        ]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        threading.Thread(target=self._read_output, args=(process,), name="fmp4-reader", daemon=True).start()
+        logging.info(f"ffmpeg iniciado para /video.mp4 ({width}x{height} a {self.fps} fps, {self.bitrate})")
+        return process
+
+    def _stop_encoder(self, process):
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def _read_output(self, process):
+        header = []
+        init = None
+        moof = None
+        for box_type, box in _read_boxes(process.stdout):
+            if box_type in (b'ftyp', b'moov'):
+                header.append(box)
+                if box_type == b'moov':
+                    init = b''.join(header)
+            elif box_type == b'moof':
+                moof = box
+            elif box_type == b'mdat' and moof is not None and init is not None:
+                self.hub.publish(Fragment(_is_keyframe(moof), moof + box, init))
+                moof = None
+
+
+class FragmentCursor:
+    """Posición de un cliente en el hub de fragmentos.
+
+    Empieza en un keyframe precedido por el segmento de inicialización (y
+    lo vuelve a enviar si ffmpeg se reinició, p. ej. porque cambió la
+    resolución). Si el cliente se saltó fragmentos por ir atrasado, descarta
+    los siguientes hasta el próximo keyframe para que el decodificador nunca
+    reciba un delta sin su referencia.
+    """
+
+    def __init__(self):
+        self.last_seq = 0
+        self._synced = False
+        self._init = None
+
+    def accept(self, frame):
+        # Devuelve las piezas a enviar, o () si hay que esperar un keyframe
+        fragment = frame.data
+        if self.last_seq and frame.seq != self.last_seq + 1:
+            self._synced = False
+        self.last_seq = frame.seq
+        if fragment.init is not self._init:
+            self._synced = False
+        if not self._synced:
+            if not fragment.keyframe:
+                return ()
+            self._synced = True
+            if fragment.init is not self._init:
+                self._init = fragment.init
+                return (fragment.init, fragment.data)
+        return (fragment.data,)
+
+
+def _read_boxes(stream):
+    # Cajas de primer nivel de un MP4 leído de un pipe: (tipo, caja completa con su cabecera)
+    while True:
+        header = _read_exact(stream, BOX_HEADER.size)
+        if header is None:
+            return
+        size, box_type = BOX_HEADER.unpack(header)
+        if size == 1:
+            extended = _read_exact(stream, 8)
+            if extended is None:
+                return
+            header += extended
+            size = struct.unpack('>Q', extended)[0]
+        payload = _read_exact(stream, size - len(header))
+        if payload is None:
+            return
+        yield box_type, header + payload
+
+
+def _read_exact(stream, size):
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _children(data, start, end):
+    while start + 8 <= end:
+        size, box_type = BOX_HEADER.unpack_from(data, start)
+        if size < 8:
+            return
+        yield box_type, start + 8, start + size
+        start += size
+
+
+def _is_keyframe(moof):
+    # El primer sample del fragmento es sync si sus flags no tienen NON_SYNC_SAMPLE
+    for box_type, start, end in _children(moof, 0, len(moof)):
+        if box_type != b'moof':
+            continue
+        for traf_type, traf_start, traf_end in _children(moof, start, end):
+            if traf_type != b'traf':
+                continue
+            default_flags = None
+            for child, offset, _ in _children(moof, traf_start, traf_end):
+                flags = int.from_bytes(moof[offset + 1:offset + 4], 'big')
+                if child == b'tfhd':
+                    position = offset + 8  # version/flags y track_ID
+                    for bit, length in ((0x1, 8), (0x2, 4), (0x8, 4), (0x10, 4)):
+                        if flags & bit:
+                            position += length
+                    if flags & 0x20:
+                        default_flags = struct.unpack_from('>I', moof, position)[0]
+                elif child == b'trun':
+                    position = offset + 8  # version/flags y sample_count
+                    if flags & 0x1:
+                        position += 4  # data_offset
+                    if flags & 0x4:
+                        return not struct.unpack_from('>I', moof, position)[0] & NON_SYNC_SAMPLE
+                    if flags & 0x400:
+                        position += 4 * bool(flags & 0x100) + 4 * bool(flags & 0x200)
+                        return not struct.unpack_from('>I', moof, position)[0] & NON_SYNC_SAMPLE
+                    if default_flags is not None:
+                        return not default_flags & NON_SYNC_SAMPLE
+    return True
@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import namedtuple
+
+# Frame publicado: número de secuencia, instante de captura (time.monotonic), datos (p. ej. el JPEG)
+# y, en los hubs MJPEG, la parte multipart ya armada como (cabecera, datos, cierre)
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'data', 'chunks'], defaults=(None,))
+
+MULTIPART_TRAILER = b'\r\n'
+MAX_PART_HEADER = 4096  # Tamaño máximo de las cabeceras de una parte multipart
+MAX_PART_SIZE = 32 * 1024 * 1024  # Tamaño máximo de una parte sin Content-Length, leída hasta el boundary
+PART_SCAN_CHUNK = 64 * 1024  # Bytes por lectura al buscar el boundary
+
+
+def multipart_chunks(data, timestamp=None, content_type=b'image/jpeg'):
+    # Sólo se arma la cabecera: los datos no se copian y las tres piezas se escriben por separado.
+    # X-Timestamp es el instante de captura (time.monotonic) para medir la antigüedad en el mismo equipo
+    header = (b'--frame\r\nContent-Type: ' + content_type +
+              b'\r\nContent-Length: ' + str(len(data)).encode('ascii') + b'\r\n')
+    if timestamp is not None:
+        header += b'X-Timestamp: ' + f'{timestamp:.6f}'.encode('ascii') + b'\r\n'
+    header += b'\r\n'
+    return (header, data, MULTIPART_TRAILER)
+
+
+def multipart_boundary(content_type, default=b'frame'):
+    # Boundary de una cabecera "multipart/x-mixed-replace; boundary=frame"
+    for param in (content_type or '').split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'boundary' and value.strip('"'):
+            return value.strip('"').encode('latin-1')
+    return default
+
+
+def read_multipart_part(stream, boundary=b'frame'):
+    """Lee la próxima parte de un multipart/x-mixed-replace como el que arma multipart_chunks().
+
+    stream sólo necesita readline() y read(), p. ej. un
+    http.client.HTTPResponse. Devuelve (cabeceras en minúsculas, datos) o
+    None si el stream terminó, aunque sea a mitad de una parte. Los datos
+    se leen con Content-Length; si la parte no lo trae (versiones
+    anteriores de SCam, otras cámaras MJPEG) se leen hasta la línea del
+    boundary.
+    """
+    headers = _read_part_headers(stream)
+    if headers is None:
+        return None
+    if 'content-length' in headers:
+        length = int(headers['content-length'])
+        data = stream.read(length)
+        return (headers, data) if len(data) == length else None
+    delimiter = b'--' + boundary
+    pieces = []
+    size = 0
+    line_start = True
+    while True:
+        line = stream.readline(PART_SCAN_CHUNK)
+        if not line:
+            return None
+        if line_start and line.startswith(delimiter):
+            break  # La línea del boundary ya es de la parte siguiente; _read_part_headers no la necesita
+        pieces.append(line)
+        size += len(line)
+        if size > MAX_PART_SIZE:
+            raise ValueError("Parte multipart sin Content-Length demasiado grande")
+        line_start = line.endswith(b'\n')
+    data = b''.join(pieces)
+    # El CRLF antes del boundary es parte del delimitador, no de los datos
+    if data.endswith(b'\r\n'):
+        return headers, data[:-2]
+    return headers, data[:-1] if data.endswith(b'\n') else data
+
+
+def _read_part_headers(stream):
+    headers = {}
+    size = 0
+    while True:
+        line = stream.readline(MAX_PART_HEADER)
+        if not line:
+            return None
+        size += len(line)
+        if size > MAX_PART_HEADER:
+            raise ValueError("Cabeceras de la parte multipart demasiado largas")
+        line = line.strip()
+        if not line:
+            if headers:
+                return headers
+            continue  # Cierre de la parte anterior
+        name, separator, value = line.decode('latin-1').partition(':')
+        if separator:
+            headers[name.strip().lower()] = value.strip()
+        # Sin ':' es la línea del boundary (--frame)
+
+
+class FrameHub:
+    """Difunde el último frame publicado a todos los clientes que esperan.
+
+    Cada publicación recibe un número de secuencia creciente. Los clientes
+    esperan con el último número que enviaron y se despiertan sólo cuando hay
+    un frame más nuevo; si llegan tarde reciben directamente el más reciente.
+    Con multipart=True cada frame lleva su parte multipart armada una sola
+    vez y compartida, inmutable, por todas las conexiones.
+    """
+
+    def __init__(self, multipart=False):
+        self.multipart = multipart
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0  # Sigue creciendo aunque se olvide el último frame con clear()
+        self._closed = False
+        self._listeners = []  # Callbacks invocados en el hilo que publica, p. ej. para despertar un event loop
+
+    def publish(self, data, timestamp=None):
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+            if timestamp is None:
+                timestamp = time.monotonic()
+            chunks = multipart_chunks(data, timestamp) if self.multipart else None
+            frame = self._frame = Frame(seq, timestamp, data, chunks)
+            self._cond.notify_all()
+        for listener in self._listeners:
+            listener(frame)
+        return seq
+
+    def latest(self):
+        return self._frame
+
+    def clear(self):
+        # Olvidar el último frame: quien espere después recibe sólo frames publicados desde ahora
+        with self._cond:
+            self._frame = None
+
+    def wait(self, last_seq=0, timeout=None):
+        # Devuelve el frame más reciente con seq > last_seq, o None si vence el timeout o se cerró el hub
+        with self._cond:
+            self._cond.wait_for(self._has_newer(last_seq), timeout)
+            frame = self._frame
+            if self._closed or frame is None or frame.seq <= last_seq:
+                return None
+            return frame
+
+    def add_listener(self, callback):
+        with self._cond:
+            self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        with self._cond:
+            self._listeners = [l for l in self._listeners if l != callback]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for listener in self._listeners:
+            listener(None)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _has_newer(self, last_seq):
+        return lambda: self._closed or (self._frame is not None and self._frame.seq > last_seq)
@@ -0,0 +1,169 @@
+import copy
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_QUEUE_SIZE = 10000  # Registros en espera del escritor antes de empezar a descartar
+DUPLICATE_WINDOW = 10.0  # Segundos durante los que un mensaje repetido se cuenta en lugar de escribirse
+MAX_DUPLICATE_KEYS = 1024  # Mensajes distintos recordados por el filtro de duplicados
+
+# Atributos propios de LogRecord; el resto son campos pasados con extra= y van tal cual al JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler con cola acotada que nunca bloquea al hilo que loguea.
+
+    Si el escritor no da abasto se descartan registros; al volver a haber
+    lugar se encola un aviso con la cantidad descartada.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # Como QueueHandler.prepare, pero la traza queda aparte en exc_text para que JsonFormatter la separe
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        with self._lock:
+            try:
+                if self.dropped:
+                    notice = logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+                                               f"Se descartaron {self.dropped} mensajes de log por falta de lugar en la cola",
+                                               None, None)
+                    self.queue.put_nowait(notice)
+                    self.dropped = 0
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+
+class DuplicateFilter(logging.Filter):
+    """Agrupa los mensajes repetidos: el mismo texto con el mismo nivel se escribe
+    una vez cada window segundos, y la siguiente vez indica cuántas veces se
+    repitió mientras tanto.
+
+    Corre en el hilo del QueueListener, no en el que loguea.
+    """
+
+    def __init__(self, window=DUPLICATE_WINDOW, max_keys=MAX_DUPLICATE_KEYS):
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        self._seen = {}  # (nivel, mensaje) -> [instante en que se escribió, repeticiones desde entonces]
+
+    def filter(self, record):
+        key = (record.levelno, record.getMessage())
+        entry = self._seen.get(key)
+        if entry is not None and record.created - entry[0] < self.window:
+            entry[1] += 1
+            return False
+        if entry is not None and entry[1]:
+            record.msg = f"{record.getMessage()} (repetido {entry[1]} veces en {record.created - entry[0]:.0f} s)"
+            record.args = None
+        if entry is None and len(self._seen) >= self.max_keys:
+            self._prune(record.created)
+        self._seen[key] = [record.created, 0]
+        return True
+
+    def _prune(self, now):
+        for key, (written, _) in list(self._seen.items()):
+            if now - written >= self.window:
+                del self._seen[key]
+        if len(self._seen) >= self.max_keys:
+            self._seen.clear()
+
+
+class JsonFormatter(logging.Formatter):
+    # Una línea JSON por registro, con los campos pasados en extra= (p. ej. client) como claves propias
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ClientLogLimiter:
+    """Límite de logs por cliente (token bucket por IP) para /log y /report.
+
+    Cada cliente puede enviar burst mensajes seguidos y después uno cada
+    1 / rate segundos; allow() devuelve además cuántos se le descartaron
+    desde el último aceptado, para dejarlo asentado en ese mensaje.
+    """
+
+    def __init__(self, rate=0.5, burst=10, max_clients=1024):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = {}  # cliente -> [tokens, último instante, descartados]
+
+    def allow(self, client):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                if len(self._buckets) >= self.max_clients:
+                    self._prune(now)
+                bucket = self._buckets[client] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False, 0
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+            return True, suppressed
+
+    def _prune(self, now):
+        # Olvidar los clientes con el balde lleno: no tienen nada pendiente
+        for client, (tokens, last, suppressed) in list(self._buckets.items()):
+            if not suppressed and tokens + (now - last) * self.rate >= self.burst:
+                del self._buckets[client]
+
+
+def setup_logging(level=logging.INFO, json_lines=False, stream=None):
+    """Configura el logger raíz para que loguear nunca bloquee al que llama.
+
+    Los registros van a una cola acotada (BoundedQueueHandler) y un
+    QueueListener los filtra (DuplicateFilter), los formatea como texto o
+    como líneas JSON y los escribe en stream desde su propio hilo.
+    Devuelve el listener: stop() escribe lo que quede en la cola.
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(LOG_FORMAT))
+    handler.addFilter(DuplicateFilter())
+    root = logging.getLogger()
+    for previous in list(root.handlers):
+        root.removeHandler(previous)
+    root.addHandler(BoundedQueueHandler(queue.Queue(LOG_QUEUE_SIZE)))
+    root.setLevel(level)
+    listener = QueueListener(root.handlers[0].queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,219 @@
+import bisect
+import math
+import threading
+
+# Límites de los histogramas más usados
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5)  # Segundos
+ENCODE_BUCKETS = (0.001, 0.0025, 0.005, 0.0075, 0.01, 0.015, 0.025, 0.05, 0.1)  # Segundos
+SIZE_BUCKETS = (4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576)  # Bytes
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self):
+        return [(self.name, {}, self._value)]
+
+    def snapshot(self):
+        return self._value
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._value = 0
+
+    def set(self, value):
+        self._value = value  # Una asignación es atómica: no hace falta lock
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self):
+        return [(self.name, {}, self._value)]
+
+    def snapshot(self):
+        return self._value
+
+
+class Histogram:
+    """Histograma de buckets fijos, acumulativo como los de Prometheus.
+
+    observe() sólo busca el bucket con bisect e incrementa dos contadores
+    bajo un lock propio del histograma; los percentiles del snapshot JSON se
+    estiman con el límite superior del bucket que los contiene.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)  # El último es +Inf
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def quantile(self, q):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            value_sum = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            samples.append((self.name + '_bucket', {'le': _format_value(bound)}, cumulative))
+        samples.append((self.name + '_sum', {}, value_sum))
+        samples.append((self.name + '_count', {}, total))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            total = self._count
+            value_sum = self._sum
+        return {
+            'count': total,
+            'avg': value_sum / total if total else None,
+            'p50': _finite(self.quantile(0.5)),
+            'p90': _finite(self.quantile(0.9)),
+            'p99': _finite(self.quantile(0.99)),
+        }
+
+
+class MetricsRegistry:
+    """Métricas del servicio, exportables en formato de texto de Prometheus o JSON.
+
+    counter(), gauge() y histogram() devuelven la métrica existente si ya
+    hay una con ese nombre, así un pipeline recreado sigue sumando sobre la
+    misma serie. Las métricas con etiquetas que dependen de objetos vivos
+    (p. ej. una serie por cliente) se arman con add_collector() en cada
+    consulta, así que desaparecen solas cuando el objeto deja de existir.
+    Un collector devuelve una lista de (nombre, tipo, ayuda, [(etiquetas, valor)]).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def counter(self, name, help_text):
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self._lock:
+            self._collectors = [c for c in self._collectors if c != collector]
+
+    def render_prometheus(self):
+        lines = []
+        for name, kind, help_text, samples in self._families():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        snapshot = {metric.name: metric.snapshot() for metric in metrics}
+        for collector in collectors:
+            for name, kind, help_text, samples in collector():
+                snapshot[name] = [dict(labels, value=value) for labels, value in samples]
+        return snapshot
+
+    def _get_or_create(self, cls, name, help_text, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"La métrica {name} ya existe con otro tipo")
+            return metric
+
+    def _families(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            yield metric.name, metric.kind, metric.help, metric.samples()
+        for collector in collectors:
+            for name, kind, help_text, samples in collector():
+                yield name, kind, help_text, [(name, labels, value) for labels, value in samples]
+
+
+def _finite(value):
+    # JSON no admite infinito: un percentil en el bucket +Inf se informa como null
+    return None if value == math.inf else value
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,322 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from hub import FrameHub
+from metrics import ENCODE_BUCKETS, SIZE_BUCKETS, MetricsRegistry
+from renditions import encode_renditions
+
+EWMA_ALPHA = 0.1  # Peso de la última muestra en los promedios de costo
+MAX_SAMPLE_STEP = 32  # Submuestreo máximo del detector de cambios
+
+
+class ChangeDetector:
+    """Detecta si un frame cambió respecto al último que se codificó.
+
+    Compara una versión submuestreada (una vista cada `step` píxeles, sin
+    copiar el frame) contra la referencia: el frame cuenta como cambiado si
+    más de area_threshold de los píxeles muestreados difieren en más de
+    pixel_threshold en algún canal. Comparar contra el último frame
+    codificado, y no contra el anterior, evita perder cambios lentos.
+    """
+
+    def __init__(self, pixel_threshold=20, area_threshold=0.002, step=8):
+        self.pixel_threshold = pixel_threshold
+        self.area_threshold = area_threshold
+        self.step = step
+        self.cost = 0.0  # Costo promedio de una comparación (s)
+        self._reference = None
+
+    def changed(self, frame):
+        start = time.perf_counter()
+        sample = frame[::self.step, ::self.step].astype(np.int16)
+        reference = self._reference
+        if reference is None or reference.shape != sample.shape:
+            changed = True
+        else:
+            moved = np.abs(sample - reference) > self.pixel_threshold
+            if moved.ndim == 3:
+                moved = moved.any(axis=-1)
+            changed = moved.mean() > self.area_threshold
+        if changed:
+            self._reference = sample
+        self.cost = _ewma(self.cost, time.perf_counter() - start)
+        return changed
+
+    def coarsen(self):
+        # Muestrear menos píxeles si la detección llega a costar más que la codificación que ahorra
+        if self.step < MAX_SAMPLE_STEP:
+            self.step *= 2
+            self._reference = None
+            self.cost = 0.0
+
+
+class EncodePool:
+    """Grupo de workers de codificación compartido por varios EncodePipeline.
+
+    Cada pipeline tiene su propia cola acotada; cuando está llena se
+    descarta su frame más viejo. Los workers atienden a los pipelines con
+    frames pendientes por turnos (round-robin), así una fuente con mucho
+    movimiento o alta resolución no deja sin encoders a las demás.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._queues = {}  # pipeline -> deque de frames pendientes
+        self._ready = deque()  # Pipelines con frames pendientes, en orden de turno
+        self._idle_workers = 0
+        self._running = True
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"encoder-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def register(self, pipeline):
+        with self._cond:
+            self._queues[pipeline] = deque()
+
+    def unregister(self, pipeline):
+        # Los frames que quedaban en cola se descartan sin codificar
+        with self._cond:
+            self._queues.pop(pipeline, None)
+            if pipeline in self._ready:
+                self._ready.remove(pipeline)
+            self._cond.notify_all()
+
+    def submit(self, pipeline, item, max_queue):
+        # Devuelve el frame descartado para hacerle lugar al nuevo, o None
+        with self._cond:
+            pending = self._queues.get(pipeline)
+            if pending is None:
+                return item
+            dropped = pending.popleft() if len(pending) >= max_queue else None
+            if not pending:
+                self._ready.append(pipeline)
+            pending.append(item)
+            self._cond.notify_all()
+            return dropped
+
+    def pending(self, pipeline=None):
+        with self._cond:
+            if pipeline is None:
+                return sum(len(pending) for pending in self._queues.values())
+            return len(self._queues.get(pipeline, ()))
+
+    def wait_ready(self, timeout=None):
+        # Esperar a que un encoder libre pueda tomar el próximo frame apenas se envíe
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._idle_workers > sum(len(pending) for pending in self._queues.values())
+                or not self._running, timeout)
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def _next_item(self):
+        with self._cond:
+            self._idle_workers += 1
+            self._cond.notify_all()
+            while self._running and not self._ready:
+                self._cond.wait()
+            self._idle_workers -= 1
+            if not self._running:
+                return None, None
+            pipeline = self._ready.popleft()
+            pending = self._queues[pipeline]
+            item = pending.popleft()
+            if pending:
+                self._ready.append(pipeline)  # Vuelve al final de la fila: turnos equitativos entre fuentes
+            return pipeline, item
+
+    def _worker(self):
+        while True:
+            pipeline, item = self._next_item()
+            if pipeline is None:
+                break
+            pipeline._encode(item)
+
+
+class EncodePipeline:
+    """Etapa de codificación JPEG en paralelo entre la captura y los FrameHub.
+
+    La captura entrega frames crudos con submit(); un grupo de workers
+    codifica cada variante activa del RenditionSet (cv2.imencode libera el
+    GIL, así que corren en paralelo) y la salida se reordena por número de
+    secuencia antes de publicarse. Si los encoders no dan abasto se descarta
+    el frame más viejo en cola. Con un ChangeDetector los frames sin cambios
+    no se codifican; cada keepalive_interval segundos se vuelve a publicar
+    el último JPEG de cada variante para que los clientes sigan vivos.
+    Los frames crudos se publican además en raw_hub para las salidas que
+    necesitan la imagen sin codificar (p. ej. el streaming por tiles).
+    wait_ready() permite a la captura leer el frame recién cuando hay un
+    encoder libre, en lugar de encolar frames que envejecen esperando.
+    Las métricas de captura y codificación se registran en metrics. Con
+    pool, varios pipelines (uno por fuente) comparten los mismos encoders.
+    """
+
+    def __init__(self, renditions, workers=2, max_queue=None, detector=None, keepalive_interval=1.0,
+                 metrics=None, pool=None):
+        self.renditions = renditions
+        self.raw_hub = FrameHub()
+        self.detector = detector
+        self.keepalive_interval = keepalive_interval
+        self.encode_cost = 0.0  # Costo promedio de codificar un frame (s)
+        self.capture_to_publish = 0.0  # Demora promedio desde la captura hasta publicar el JPEG (s)
+        self._last_publish = 0.0
+        self._last_submit = None
+        metrics = metrics or MetricsRegistry()
+        self._captured_total = metrics.counter('scam_frames_captured_total', "Frames recibidos de la fuente")
+        self._capture_fps = metrics.gauge('scam_capture_fps', "Frames por segundo recibidos de la fuente")
+        self._dropped_total = metrics.counter('scam_frames_dropped_total',
+                                              "Frames descartados porque los encoders iban atrasados")
+        self._unchanged_total = metrics.counter('scam_frames_unchanged_total', "Frames sin cambios que no se codificaron")
+        self._queue_depth = metrics.gauge('scam_encode_queue_depth', "Frames en cola esperando un encoder")
+        self._encode_seconds = metrics.histogram('scam_encode_seconds', "Tiempo de codificar un frame (todas sus variantes)",
+                                                 ENCODE_BUCKETS)
+        self._frame_bytes = metrics.histogram('scam_frame_bytes', "Tamaño de cada JPEG codificado", SIZE_BUCKETS)
+        self._publish_seconds = metrics.histogram('scam_capture_to_publish_seconds',
+                                                  "Demora desde la captura hasta publicar el JPEG")
+        self._unchanged = 0
+        self._owns_pool = pool is None
+        self._pool = pool or EncodePool(workers)
+        self.max_queue = max_queue or self._pool.workers * 2
+        self._lock = threading.Lock()
+        self._pending = {}  # seq -> (timestamp, datos) esperando a que salgan los anteriores
+        self._next_seq = 1
+        self._next_out = 1
+        self._reference_seq = 0  # seq del último frame que el detector consideró cambiado
+        self._encoded_seq = {}  # variante -> seq del frame del que sale su último JPEG
+        self._encoded = 0
+        self._dropped = 0
+        self._pool.register(self)
+
+    def submit(self, frame, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.raw_hub.publish(frame, timestamp)
+        self.renditions.source_width = frame.shape[1]
+        self._captured_total.inc()
+        now = time.monotonic()
+        if self._last_submit is not None and now > self._last_submit:
+            self._capture_fps.set(_ewma(self._capture_fps.value, 1.0 / (now - self._last_submit)))
+        self._last_submit = now
+        keys = self.renditions.active()
+        if not keys:
+            return None  # Nadie está mirando: no hay nada que codificar
+        if self.detector is None or self.detector.changed(frame):
+            self._reference_seq = self._next_seq  # Este frame pasa a ser la referencia del detector
+        else:
+            # Sólo hace falta codificar las variantes sin frame o cuyo último JPEG es anterior a la referencia
+            # (p. ej. una variante que quedó sin suscriptores mientras cambiaba la escena)
+            keys = [key for key in keys if self._stale(key)]
+            if not keys:
+                self._unchanged += 1
+                self._unchanged_total.inc()
+                self._keepalive(timestamp)
+                return None
+        if self.detector is not None and self.encode_cost and self.detector.cost > self.encode_cost:
+            self.detector.coarsen()
+        seq = self._next_seq
+        self._next_seq += 1
+        dropped = self._pool.submit(self, (seq, timestamp, frame, keys), self.max_queue)
+        if dropped is not None:
+            # Los encoders van atrasados: se descartó el frame más viejo para encolar el nuevo
+            self._complete(dropped[0], None, None)
+            self._dropped += 1
+            self._dropped_total.inc()
+        self._queue_depth.set(self._pool.pending())
+        return seq
+
+    def wait_ready(self, timeout=None):
+        return self._pool.wait_ready(timeout)
+
+    def stats(self):
+        return {
+            'capture_queue': self._pool.pending(self),
+            'reorder_pending': len(self._pending),
+            'renditions': self.renditions.count(),
+            'encoded': self._encoded,
+            'dropped': self._dropped,
+            'unchanged': self._unchanged,
+            'encode_ms': round(self.encode_cost * 1000, 2),
+            'capture_to_publish_ms': round(self.capture_to_publish * 1000, 1),
+            'detect_ms': round(self.detector.cost * 1000, 3) if self.detector is not None else None,
+        }
+
+    def close(self):
+        self.raw_hub.close()
+        self._pool.unregister(self)
+        if self._owns_pool:
+            self._pool.close()
+
+    def _encode(self, item):
+        # Lo llama un worker del EncodePool
+        self._queue_depth.set(self._pool.pending())
+        seq, timestamp, frame, keys = item
+        data = None
+        try:
+            start = time.perf_counter()
+            data = encode_renditions(frame, keys)
+            elapsed = time.perf_counter() - start
+            self.encode_cost = _ewma(self.encode_cost, elapsed)
+            self._encode_seconds.observe(elapsed)
+            for encoded in data.values():
+                self._frame_bytes.observe(len(encoded))
+            with self._lock:
+                for key in data:
+                    self._encoded_seq[key] = max(seq, self._encoded_seq.get(key, 0))
+            self._encoded += 1
+        except Exception as e:
+            logging.error(f"Error al codificar el frame {seq}: {e}")
+        self._complete(seq, timestamp, data)
+
+    def _complete(self, seq, timestamp, data):
+        # Publicar en orden: un frame sólo sale cuando todos los anteriores ya salieron o se descartaron
+        with self._lock:
+            self._pending[seq] = (timestamp, data)
+            while self._next_out in self._pending:
+                timestamp, data = self._pending.pop(self._next_out)
+                if data:
+                    for key, encoded in data.items():
+                        hub = self.renditions.hub(key)
+                        if hub is not None:
+                            hub.publish(encoded, timestamp)
+                    self._last_publish = time.monotonic()
+                    self.capture_to_publish = _ewma(self.capture_to_publish, self._last_publish - timestamp)
+                    self._publish_seconds.observe(self._last_publish - timestamp)
+                self._next_out += 1
+
+    def _stale(self, key):
+        with self._lock:
+            encoded_seq = self._encoded_seq.get(key, 0)
+        return self._latest(key) is None or encoded_seq < self._reference_seq
+
+    def _latest(self, key):
+        hub = self.renditions.hub(key)
+        return hub.latest() if hub is not None else None
+
+    def _keepalive(self, timestamp):
+        if time.monotonic() - self._last_publish < self.keepalive_interval:
+            return
+        # Republicar el último JPEG de cada variante activa, en orden con los frames en vuelo
+        data = {}
+        for key in self.renditions.active():
+            latest = self._latest(key)
+            if latest is not None:
+                data[key] = latest.data
+        seq = self._next_seq
+        self._next_seq += 1
+        self._complete(seq, timestamp, data)
+
+
+def _ewma(current, sample):
+    if not current:
+        return sample
+    return current + EWMA_ALPHA * (sample - current)
@@ -0,0 +1,249 @@
+import bisect
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Entrada del índice de cada segmento: instante (time.time) del frame, offset y largo del JPEG en el segmento
+INDEX_ENTRY = struct.Struct('<dQI')
+SEGMENT_SUFFIX = '.mjpg'
+INDEX_SUFFIX = '.idx'
+
+
+class _Segment:
+    def __init__(self, path, start):
+        self.path = path  # Ruta sin extensión; los datos van en .mjpg y el índice en .idx
+        self.start = start
+
+    @property
+    def data_path(self):
+        return self.path + SEGMENT_SUFFIX
+
+    @property
+    def index_path(self):
+        return self.path + INDEX_SUFFIX
+
+    def size(self):
+        total = 0
+        for path in (self.data_path, self.index_path):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def remove(self):
+        for path in (self.data_path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class SegmentRecorder:
+    """Grabación continua (DVR) de los JPEG ya codificados en segmentos en disco.
+
+    Un hilo propio espera los frames del FrameHub con wait() y agrega los
+    bytes tal cual a un archivo de segmento, más una entrada de índice
+    (instante, offset, largo); si el disco va lento se salta frames en vez
+    de frenar al pipeline, así que la grabación no agrega latencia a la
+    transmisión en vivo. Al llegar a segment_size se empieza un segmento
+    nuevo y se borran los más viejos hasta quedar bajo quota bytes.
+    frames() lee lo grabado mapeando los segmentos en memoria, sin
+    decodificar nada.
+    """
+
+    def __init__(self, directory, hub, segment_size=64 * 1024 * 1024, quota=1024 * 1024 * 1024,
+                 frame_timeout=1.0):
+        self.directory = directory
+        self.hub = hub
+        # Al menos cuatro segmentos dentro de la cuota, para poder respetarla rotando
+        self.segment_size = max(1, min(segment_size, quota // 4))
+        self.quota = quota
+        self.frame_timeout = frame_timeout
+        self._lock = threading.Lock()
+        self._segments = []
+        self._data = None
+        self._index = None
+        self._offset = 0
+        self._running = False
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+        self._load_segments()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=self.frame_timeout * 2)
+        self._close_segment()
+
+    def range(self):
+        # (primer instante, último instante) grabados, o None si todavía no hay nada
+        with self._lock:
+            segments = list(self._segments)
+        first = last = None
+        for segment in segments:
+            entries = _read_index(segment.index_path)
+            if entries:
+                first = entries[0][0]
+                break
+        for segment in reversed(segments):
+            entries = _read_index(segment.index_path)
+            if entries:
+                last = entries[-1][0]
+                break
+        return (first, last) if first is not None else None
+
+    def stats(self):
+        with self._lock:
+            segments = list(self._segments)
+        recorded = self.range()
+        return {
+            'segments': len(segments),
+            'bytes': sum(segment.size() for segment in segments),
+            'from': recorded[0] if recorded else None,
+            'to': recorded[1] if recorded else None,
+        }
+
+    def frames(self, start):
+        """Genera (instante, JPEG) desde el primer frame grabado en o después de start (time.time).
+
+        No espera entre frames: el ritmo de reproducción lo pone quien
+        consume el generador. Termina al alcanzar el final de lo grabado.
+        """
+        with self._lock:
+            segments = list(self._segments)
+        starts = [segment.start for segment in segments]
+        position = max(0, bisect.bisect_right(starts, start) - 1)
+        for segment in segments[position:]:
+            entries = _read_index(segment.index_path)
+            if not entries or entries[-1][0] < start:
+                continue
+            try:
+                with open(segment.data_path, 'rb') as file, \
+                        mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    first = bisect.bisect_left([entry[0] for entry in entries], start)
+                    for timestamp, offset, length in entries[first:]:
+                        if offset + length > len(mapped):
+                            break  # Entrada escrita después de mapear el segmento
+                        yield timestamp, mapped[offset:offset + length]
+            except (OSError, ValueError):
+                continue  # El segmento se rotó mientras se leía, o está vacío
+
+    def _run(self):
+        last_seq = 0
+        while self._running:
+            frame = self.hub.wait(last_seq, timeout=self.frame_timeout)
+            if frame is None:
+                if self.hub.closed:
+                    break
+                continue
+            last_seq = frame.seq
+            # El instante de captura es monotónico; el índice guarda la hora real para poder buscar por fecha
+            timestamp = time.time() - (time.monotonic() - frame.timestamp)
+            try:
+                self._append(timestamp, frame.data)
+            except OSError as e:
+                logging.error(f"Error al grabar el frame en {self.directory}: {e}")
+                self._close_segment()
+
+    def _append(self, timestamp, data):
+        if self._data is None or self._offset + len(data) > self.segment_size:
+            self._rotate(timestamp)
+        self._data.write(data)
+        self._data.flush()  # Los datos tienen que estar en el archivo antes que la entrada del índice
+        self._index.write(INDEX_ENTRY.pack(timestamp, self._offset, len(data)))
+        self._index.flush()
+        self._offset += len(data)
+
+    def _rotate(self, timestamp):
+        self._close_segment()
+        segment = _Segment(os.path.join(self.directory, f'segment-{int(timestamp * 1000)}'), timestamp)
+        self._data = open(segment.data_path, 'wb')
+        self._index = open(segment.index_path, 'wb')
+        self._offset = 0
+        with self._lock:
+            self._segments.append(segment)
+        self._enforce_quota()
+
+    def _enforce_quota(self):
+        with self._lock:
+            segments = list(self._segments)
+        total = sum(segment.size() for segment in segments)
+        # Dejar lugar para el segmento nuevo, que nunca se borra mientras se está escribiendo
+        for segment in segments[:-1]:
+            if total + self.segment_size <= self.quota:
+                break
+            size = segment.size()
+            try:
+                segment.remove()
+            except OSError as e:
+                logging.warning(f"No se pudo borrar el segmento {segment.path}: {e}")
+                continue  # En Windows falla mientras se está reproduciendo; se reintenta en la próxima rotación
+            total -= size
+            with self._lock:
+                self._segments.remove(segment)
+
+    def _close_segment(self):
+        for file in (self._data, self._index):
+            if file is not None:
+                file.close()
+        self._data = None
+        self._index = None
+
+    def _load_segments(self):
+        # Retomar los segmentos de una ejecución anterior
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith('segment-') and name.endswith(SEGMENT_SUFFIX):
+                path = os.path.join(self.directory, name[:-len(SEGMENT_SUFFIX)])
+                entries = _read_index(path + INDEX_SUFFIX)
+                if entries:
+                    segments.append(_Segment(path, entries[0][0]))
+        self._segments = sorted(segments, key=lambda segment: segment.start)
+
+
+def _read_index(path):
+    try:
+        with open(path, 'rb') as file:
+            raw = file.read()
+    except OSError:
+        return []
+    usable = len(raw) - len(raw) % INDEX_ENTRY.size  # Ignorar una entrada a medio escribir
+    return list(INDEX_ENTRY.iter_unpack(raw[:usable]))
+
+
+class ReplayClock:
+    # Reproduce los frames con los intervalos con que se grabaron, multiplicados por speed
+    def __init__(self, speed=1.0):
+        speed = float(speed)
+        if not math.isfinite(speed) or speed <= 0:
+            raise ValueError(f"Velocidad de reproducción inválida: {speed}")
+        self.speed = speed
+        self._origin = None
+
+    def delay(self, timestamp):
+        now = time.monotonic()
+        if self._origin is None:
+            self._origin = (now, timestamp)
+            return 0.0
+        started, first = self._origin
+        return max(0.0, started + (timestamp - first) / self.speed - now)
+
+
+def parse_replay_start(value, now=None):
+    # "from" de /replay: hora Unix en segundos, o negativo para "hace N segundos"
+    start = float(value)
+    if not math.isfinite(start):
+        raise ValueError(f"Inicio de reproducción inválido: {value}")
+    if start <= 0:
+        start = (now or time.time()) + start
+    return start
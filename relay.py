@@ -0,0 +1,184 @@
+import http.client
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+from hub import multipart_boundary, read_multipart_part
+
+RELAY_PREFIX = 'relay:'
+CLOCK_MATCH_WINDOW = 2.0  # Segundos: si el primer frame llega con esta antigüedad o menos, upstream y edge comparten reloj
+EWMA_ALPHA = 0.1  # Peso de la última muestra en la demora promedio
+
+
+def relay_url(spec):
+    # URL del /video de la instancia upstream si spec es "relay:URL"; None para cualquier otra fuente
+    if not isinstance(spec, str) or not spec.startswith(RELAY_PREFIX):
+        return None
+    url = spec[len(RELAY_PREFIX):]
+    return url if '://' in url else 'http://' + url
+
+
+def check_relay_url(url):
+    # Sólo HTTP: la conexión al upstream usa http.client sin TLS
+    parts = urlsplit(url)
+    if parts.scheme != 'http' or not parts.hostname:
+        raise ValueError(f"URL de relay inválida: {url}")
+
+
+class RelayStage:
+    """Reenvía el /video de otra instancia de SCam sin decodificar los JPEG.
+
+    Una sola conexión al upstream por edge, sin importar cuántos clientes
+    locales haya: cada parte multipart se lee con su Content-Length y los
+    bytes del JPEG se publican tal cual en los FrameHub del RenditionSet,
+    así que los clientes locales usan el mismo camino de difusión que una
+    fuente capturada. Si se corta la conexión se reintenta con espera
+    exponencial (retry_interval hasta max_retry_interval). X-Timestamp se
+    traduce al reloj local para que la antigüedad de los frames siga
+    siendo comparable; si los relojes no coinciden (otro equipo) se toma
+    como referencia el frame que llegó más rápido. Sin clientes durante
+    idle_timeout segundos se cierra la conexión al upstream.
+    """
+
+    def __init__(self, source_id, url, renditions, idle_timeout=10.0, retry_interval=0.5, max_retry_interval=10.0,
+                 read_timeout=5.0):
+        check_relay_url(url)
+        self.source_id = source_id
+        self.url = url
+        self.name = url
+        self.renditions = renditions
+        self.pipeline = None  # Los JPEG llegan ya codificados
+        self.idle_timeout = idle_timeout
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.read_timeout = read_timeout
+        self.frames = 0
+        self.bytes = 0
+        self.reconnects = 0
+        self.connected = False
+        self.idle = True  # Sin conexión al upstream hasta que haya clientes
+        self.frame_delay = 0.0  # Demora promedio de llegada respecto de la captura en el upstream (s)
+        self.last_frame = None  # Instante (time.monotonic) en que llegó el último frame
+        self._offset = None
+        self._shared_clock = False
+        self._connection = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"relay-{self.source_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._disconnect()  # Desbloquea la lectura en curso
+        if self._thread is not None:
+            self._thread.join(timeout=self.read_timeout)
+        self.renditions.close()
+
+    def upstream_age(self):
+        # Segundos desde el último frame recibido del upstream
+        return time.monotonic() - self.last_frame if self.last_frame is not None else None
+
+    def stats(self):
+        age = self.upstream_age()
+        return {'name': self.name, 'idle': self.idle, 'frames': self.frames, 'connected': self.connected,
+                'reconnects': self.reconnects, 'bytes': self.bytes,
+                'upstream_age_ms': round(age * 1000) if age is not None else None,
+                'frame_delay_ms': round(self.frame_delay * 1000, 1)}
+
+    def _run(self):
+        retry = self.retry_interval
+        while not self._stop.is_set():
+            if not self.renditions.watched():
+                if not self.idle:
+                    logging.info(f"Sin clientes en /video/{self.source_id}: se cierra la conexión a {self.url}")
+                    self.idle = True
+                self.renditions.wait_watched(timeout=1.0)
+                continue
+            if self.idle:
+                logging.info(f"Hay clientes en /video/{self.source_id}: conectando a {self.url}")
+                self.idle = False
+            frames = self.frames
+            try:
+                self._relay()
+                error = None
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                error = e
+            finally:
+                self._disconnect()
+            if self._stop.is_set() or error is None:
+                continue
+            if self.frames > frames:
+                retry = self.retry_interval  # La conexión llegó a funcionar: volver a la espera mínima
+            self.reconnects += 1
+            logging.error(f"Error en el relay de {self.url}: {error}. Reintentando en {retry:.1f} s")
+            self._stop.wait(retry)
+            retry = min(retry * 2, self.max_retry_interval)
+
+    def _relay(self):
+        # Vuelve sin error sólo si se detuvo o se quedó sin clientes; un corte del upstream es una excepción
+        parts = urlsplit(self.url)
+        connection = self._connection = http.client.HTTPConnection(parts.hostname, parts.port or 80,
+                                                                   timeout=self.read_timeout)
+        path = parts.path or '/video'
+        if parts.query:
+            path += '?' + parts.query
+        # http.client decodifica Transfer-Encoding: chunked (el servidor de desarrollo de Flask lo usa)
+        connection.request('GET', path)
+        response = connection.getresponse()
+        if response.status != 200:
+            raise ConnectionError(f"HTTP {response.status}")
+        boundary = multipart_boundary(response.getheader('Content-Type'))
+        self.connected = True
+        self._offset = None
+        logging.info(f"Relay conectado a {self.url}")
+        unwatched_since = None
+        while not self._stop.is_set():
+            if self.renditions.watched():
+                unwatched_since = None
+            else:
+                now = time.monotonic()
+                if unwatched_since is None:
+                    unwatched_since = now
+                if now - unwatched_since >= self.idle_timeout:
+                    return
+            part = read_multipart_part(response, boundary)
+            if part is None:
+                raise ConnectionError("el upstream cerró la conexión")
+            headers, data = part
+            received = time.monotonic()
+            timestamp = self._local_timestamp(headers.get('x-timestamp'), received)
+            self.frames += 1
+            self.bytes += len(data)
+            self.last_frame = received
+            # Los mismos bytes para cualquier variante pedida: el edge no recodifica
+            for key in self.renditions.active():
+                hub = self.renditions.hub(key)
+                if hub is not None:
+                    hub.publish(data, timestamp)
+
+    def _local_timestamp(self, value, received):
+        # X-Timestamp es el instante de captura en el reloj monotónico del upstream
+        try:
+            upstream = float(value)
+        except (TypeError, ValueError):
+            return received
+        transit = received - upstream
+        if self._offset is None:
+            self._shared_clock = 0 <= transit < CLOCK_MATCH_WINDOW
+            self._offset = 0.0 if self._shared_clock else transit
+        elif not self._shared_clock and transit < self._offset:
+            self._offset = transit
+        delay = transit - self._offset
+        self.frame_delay = delay if not self.frame_delay else self.frame_delay + EWMA_ALPHA * (delay - self.frame_delay)
+        return upstream + self._offset
+
+    def _disconnect(self):
+        connection = self._connection
+        self._connection = None
+        self.connected = False
+        if connection is not None:
+            connection.close()
+
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import cv2
+
+from hub import FrameHub
+
+NATIVE_WIDTH = 0  # Ancho 0 = resolución original de la fuente
+
+
+class _Rendition:
+    def __init__(self):
+        self.hub = FrameHub(multipart=True)
+        self.subscribers = 0
+        self.idle_since = time.monotonic()
+
+
+class RenditionSet:
+    """Conjunto de variantes (ancho, calidad) que se codifican una vez por frame.
+
+    Cada cliente se suscribe a la variante que quiere y recibe los frames del
+    FrameHub correspondiente. Sólo se codifican las variantes con al menos un
+    suscriptor; las que quedan sin suscriptores durante idle_timeout segundos
+    se eliminan, y mientras tanto no conservan su último frame.
+    """
+
+    def __init__(self, default_quality=30, idle_timeout=10.0, max_renditions=8):
+        self.default_key = (NATIVE_WIDTH, default_quality)
+        self.idle_timeout = idle_timeout
+        self.max_renditions = max_renditions
+        self.source_width = None  # Ancho de los frames de la fuente, cuando ya se conoce
+        self._lock = threading.Lock()
+        self._subscribed = threading.Condition(self._lock)
+        self._entries = {}
+
+    def normalize(self, width=None, quality=None):
+        # Cuantizar los parámetros para que pedidos casi iguales compartan la misma variante
+        key_width = NATIVE_WIDTH
+        # Un ancho igual o mayor que el de la fuente no se agranda: comparte la variante original
+        if width and not (self.source_width and int(width) >= self.source_width):
+            key_width = max(16, min(4096, int(width) // 16 * 16))
+        key_quality = self.default_key[1]
+        if quality:
+            key_quality = max(5, min(100, int(quality) // 5 * 5))
+        return (key_width, key_quality)
+
+    def subscribe(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_renditions and key != self.default_key:
+                    key = self.default_key
+                    entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = _Rendition()
+            entry.subscribers += 1
+            self._subscribed.notify_all()
+            return key, entry.hub
+
+    def unsubscribe(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.subscribers -= 1
+                if entry.subscribers <= 0:
+                    entry.subscribers = 0
+                    entry.idle_since = time.monotonic()
+                    # Sin nadie mirando el JPEG envejece: el próximo suscriptor espera uno nuevo
+                    entry.hub.clear()
+
+    def active(self):
+        # Variantes que hay que codificar ahora; de paso se eliminan las inactivas
+        now = time.monotonic()
+        keys = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.subscribers > 0:
+                    keys.append(key)
+                elif now - entry.idle_since > self.idle_timeout:
+                    entry.hub.close()
+                    del self._entries[key]
+        return keys
+
+    def watched(self):
+        with self._lock:
+            return any(entry.subscribers > 0 for entry in self._entries.values())
+
+    def wait_watched(self, timeout=None):
+        # Para que la captura de una fuente sin clientes duerma hasta que alguien se suscriba
+        with self._subscribed:
+            return self._subscribed.wait_for(
+                lambda: any(entry.subscribers > 0 for entry in self._entries.values()), timeout)
+
+    def hub(self, key):
+        entry = self._entries.get(key)
+        return entry.hub if entry is not None else None
+
+    def count(self):
+        return len(self._entries)
+
+    def close(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.hub.close()
+            self._entries.clear()
+
+
+def encode_renditions(frame, keys):
+    # Escalar una sola vez por ancho y codificar cada calidad pedida
+    scaled = {}
+    encoded = {}
+    height, width = frame.shape[:2]
+    for key in keys:
+        key_width, quality = key
+        target = key_width if key_width and key_width < width else NATIVE_WIDTH
+        image = scaled.get(target)
+        if image is None:
+            if target == NATIVE_WIDTH:
+                image = frame
+            else:
+                image = cv2.resize(frame, (target, max(1, height * target // width)), interpolation=cv2.INTER_AREA)
+            scaled[target] = image
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok:
+            # imencode siempre reserva un buffer nuevo; ésta es la única copia del JPEG, compartida
+            # después por todos los clientes de la variante
+            encoded[key] = buffer.tobytes()
+    return encoded
@@ -0,0 +1,169 @@
+import logging
+import struct
+import time
+from multiprocessing import shared_memory
+
+from hub import Frame
+
+# Cabecera del anillo: cantidad de slots, tamaño de cada slot, último número de secuencia escrito
+RING_HEADER = struct.Struct('<IIQ')
+# Cabecera de cada slot: secuencia (0 mientras se escribe), instante de captura, largo del JPEG
+SLOT_HEADER = struct.Struct('<QdI4x')
+
+
+class SharedFrameRing:
+    """Anillo de frames JPEG en memoria compartida entre procesos.
+
+    Un único proceso escritor publica cada frame en el slot seq % slots; los
+    lectores de cualquier proceso se conectan por nombre. La secuencia del
+    slot se pone en 0 antes de escribirlo y se vuelve a verificar después de
+    leerlo (seqlock), así un lector nunca entrega un frame a medio escribir.
+    """
+
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        self.name = shm.name
+        self.slots, self.slot_size, _ = RING_HEADER.unpack_from(shm.buf, 0)
+        self._seq = self.last_seq()
+
+    @classmethod
+    def create(cls, name=None, slots=8, slot_size=2 * 1024 * 1024):
+        size = RING_HEADER.size + slots * (SLOT_HEADER.size + slot_size)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        RING_HEADER.pack_into(shm.buf, 0, slots, slot_size, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name, track=False):
+        # track=True sólo para procesos hijos del creador, que comparten su resource_tracker
+        if track:
+            return cls(shared_memory.SharedMemory(name=name), owner=False)
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13: evitar que el resource_tracker borre el segmento al salir un lector
+            shm = shared_memory.SharedMemory(name=name)
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def last_seq(self):
+        return RING_HEADER.unpack_from(self._shm.buf, 0)[2]
+
+    def write(self, data, timestamp=None):
+        length = len(data)
+        if length > self.slot_size:
+            logging.warning(f"Frame de {length} bytes no entra en un slot de {self.slot_size} bytes; se descarta")
+            return None
+        if timestamp is None:
+            timestamp = time.monotonic()
+        seq = self._seq + 1
+        offset = self._slot_offset(seq)
+        buf = self._shm.buf
+        SLOT_HEADER.pack_into(buf, offset, 0, timestamp, length)
+        start = offset + SLOT_HEADER.size
+        buf[start:start + length] = data
+        SLOT_HEADER.pack_into(buf, offset, seq, timestamp, length)
+        RING_HEADER.pack_into(buf, 0, self.slots, self.slot_size, seq)
+        self._seq = seq
+        return seq
+
+    def view(self, seq):
+        # Vista sin copia del slot; sólo es válida mientras valid(seq) siga siendo verdadero
+        offset = self._slot_offset(seq)
+        slot_seq, timestamp, length = SLOT_HEADER.unpack_from(self._shm.buf, offset)
+        if slot_seq != seq:
+            return None
+        start = offset + SLOT_HEADER.size
+        return Frame(seq, timestamp, self._shm.buf[start:start + length])
+
+    def valid(self, seq):
+        return SLOT_HEADER.unpack_from(self._shm.buf, self._slot_offset(seq))[0] == seq
+
+    def read_latest(self, last_seq=0):
+        # Devuelve el frame más reciente con seq > last_seq copiado a bytes, o None si no hay uno nuevo
+        seq = self.last_seq()
+        if seq <= last_seq:
+            return None
+        frame = self.view(seq)
+        if frame is None:
+            return None
+        data = bytes(frame.data)
+        frame.data.release()
+        if not self.valid(seq):
+            return None  # El escritor ya reutilizó el slot mientras se copiaba
+        return Frame(seq, frame.timestamp, data)
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def _slot_offset(self, seq):
+        return RING_HEADER.size + (seq % self.slots) * (SLOT_HEADER.size + self.slot_size)
+
+
+def capture_worker(source_spec, ring_name, stop_event, workers=2, quality=30, change_detection=None,
+                   keepalive_interval=1.0, retry_interval=5.0, low_latency=False, frame_ready=None):
+    """Proceso de captura y codificación que publica los JPEG en un SharedFrameRing.
+
+    Corre en su propio intérprete (y su propio GIL), así que la captura no
+    compite con los hilos que atienden a los clientes. change_detection es
+    None o una tupla (pixel_threshold, area_threshold). frame_ready, si se
+    pasa, es un multiprocessing.Event que se marca después de escribir cada
+    frame para que el lector no tenga que consultar el anillo. Ctrl+C se
+    ignora: el proceso termina cuando el padre marca stop_event.
+    """
+    import signal
+    import threading
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from pipeline import ChangeDetector, EncodePipeline
+    from renditions import RenditionSet
+    from sources import make_source
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ring = SharedFrameRing.attach(ring_name, track=True)
+    source = make_source(source_spec, low_latency)
+    renditions = RenditionSet(default_quality=quality, max_renditions=1)
+    key, hub = renditions.subscribe(renditions.default_key)  # El anillo siempre tiene un suscriptor
+    detector = ChangeDetector(*change_detection) if change_detection else None
+    pipeline = EncodePipeline(renditions, workers=workers, detector=detector, keepalive_interval=keepalive_interval)
+
+    def publish():
+        last_seq = 0
+        while not stop_event.is_set():
+            frame = hub.wait(last_seq, timeout=1.0)
+            if frame is not None:
+                last_seq = frame.seq
+                if ring.write(frame.data, frame.timestamp) is not None and frame_ready is not None:
+                    frame_ready.set()
+
+    writer = threading.Thread(target=publish, name="ring-writer", daemon=True)
+    writer.start()
+    try:
+        while not stop_event.is_set():
+            if not source.is_opened():
+                if not source.open():
+                    logging.error(f"No se pudo abrir {source.name}. Intentando de nuevo...")
+                    source.close()
+                    stop_event.wait(retry_interval)
+                    continue
+            if low_latency:
+                pipeline.wait_ready(1.0)
+            ret, frame = source.read()
+            if not ret:
+                logging.error(f"Error al capturar el frame de {source.name}")
+                source.close()
+                stop_event.wait(retry_interval)
+                continue
+            pipeline.submit(frame, source.timestamp)
+    finally:
+        stop_event.set()
+        source.close()
+        pipeline.close()
+        renditions.close()
+        writer.join(timeout=2)
+        ring.close()
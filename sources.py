@@ -0,0 +1,289 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameSource:
+    """Interfaz común de las fuentes de frames BGR del pipeline.
+
+    Igual que cv2.VideoCapture: open() abre el dispositivo, read() devuelve
+    (ok, frame) y close() lo libera. open() y read() se llaman desde el hilo
+    de captura, así que las fuentes pueden crear ahí sus recursos. Después
+    de cada read(), timestamp es el instante de captura del frame según
+    time.monotonic(), que acompaña al frame por todo el pipeline.
+    """
+
+    name = "Fuente"
+    timestamp = None
+
+    def open(self):
+        raise NotImplementedError
+
+    def is_opened(self):
+        raise NotImplementedError
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class _Pacer:
+    # Limita la lectura a `fps` frames por segundo sin acumular deriva
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps else 0.0
+        self._next = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next is None or now - self._next > self.interval:
+            self._next = now
+        elif self._next > now:
+            time.sleep(self._next - now)
+        self._next += self.interval
+
+
+class CameraSource(FrameSource):
+    """Cámara de OpenCV.
+
+    Con low_latency=True el buffer del driver se reduce al mínimo y un hilo
+    vacía el dispositivo continuamente con grab(), sin decodificar nada;
+    read() pide el próximo frame y el hilo lo decodifica con retrieve(). Así
+    sólo se decodifica el frame más reciente, cuando el encoder lo va a usar,
+    y nunca uno que quedó esperando en el driver.
+    """
+
+    def __init__(self, index, low_latency=False, read_timeout=5.0):
+        self.index = index
+        self.low_latency = low_latency
+        self.read_timeout = read_timeout
+        self.name = f"Cámara {index}"
+        self._cap = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._grabbing = False
+        self._requested = False
+        self._result = None
+
+    def open(self):
+        self._cap = cv2.VideoCapture(self.index)
+        if not self._cap.isOpened():
+            return False
+        if self.low_latency:
+            # No todos los backends respetan el tamaño del buffer; el hilo de grab() lo vacía igual
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            self._grabbing = True
+            self._thread = threading.Thread(target=self._grab_loop, name=f"grab-{self.index}", daemon=True)
+            self._thread.start()
+        return True
+
+    def is_opened(self):
+        if self._thread is not None and not self._grabbing:
+            return False
+        return self._cap is not None and self._cap.isOpened()
+
+    def read(self):
+        if self._thread is None:
+            ok, frame = self._cap.read()
+            self.timestamp = time.monotonic()
+            return ok, frame
+        with self._cond:
+            self._requested = True
+            self._result = None
+            if not self._cond.wait_for(lambda: self._result is not None or not self._grabbing, self.read_timeout):
+                self._requested = False
+            result = self._result
+        if result is None:
+            return False, None
+        ok, frame, self.timestamp = result
+        return ok, frame
+
+    def close(self):
+        thread = self._thread
+        self._thread = None
+        with self._cond:
+            self._grabbing = False
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout=self.read_timeout)
+        if self._cap is not None:
+            self._cap.release()
+        self._cap = None
+
+    def _grab_loop(self):
+        cap = self._cap
+        while self._grabbing:
+            ok = cap.grab()
+            timestamp = time.monotonic()
+            if not ok:
+                with self._cond:
+                    self._grabbing = False
+                    self._cond.notify_all()
+                break
+            with self._cond:
+                requested = self._requested
+            if requested:
+                # Decodificar sólo el frame recién tomado, y sólo porque alguien lo pidió
+                ok, frame = cap.retrieve()
+                with self._cond:
+                    self._requested = False
+                    self._result = (ok, frame, timestamp)
+                    self._cond.notify_all()
+
+
+class ScreenSource(FrameSource):
+    """Captura de pantalla con mss, de un monitor completo o de una región.
+
+    mss entrega BGRA en un bytearray; se envuelve sin copiar con
+    np.frombuffer y cv2.cvtColor escribe el BGR en un array nuevo por
+    frame. El pipeline retiene frames en varios lugares (la cola de
+    codificación, los encoders, raw_hub, los tiles, el fMP4) sin avisar
+    cuándo los suelta, así que ningún buffer se reutiliza.
+    """
+
+    def __init__(self, monitor=1, region=None, fps=15):
+        self.monitor = monitor
+        self.region = region  # (izquierda, arriba, ancho, alto) relativo al monitor
+        self.name = f"Pantalla {monitor}"
+        self._pacer = _Pacer(fps)
+        self._sct = None
+        self._area = None
+
+    def open(self):
+        import mss  # Sólo se necesita al capturar la pantalla
+        self._sct = mss.mss()
+        if self.monitor >= len(self._sct.monitors):
+            self.close()
+            return False
+        monitor = self._sct.monitors[self.monitor]
+        area = {'left': monitor['left'], 'top': monitor['top'], 'width': monitor['width'], 'height': monitor['height']}
+        if self.region is not None:
+            left, top, width, height = self.region
+            area = {'left': monitor['left'] + left, 'top': monitor['top'] + top,
+                    'width': min(width, monitor['width'] - left), 'height': min(height, monitor['height'] - top)}
+        self._area = area
+        return True
+
+    def is_opened(self):
+        return self._sct is not None
+
+    def read(self):
+        self._pacer.wait()
+        shot = self._sct.grab(self._area)
+        self.timestamp = time.monotonic()
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        return True, cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR)
+
+    def close(self):
+        if self._sct is not None:
+            self._sct.close()
+        self._sct = None
+
+
+class VideoFileSource(FrameSource):
+    def __init__(self, path, loop=True, fps=None):
+        self.path = path
+        self.loop = loop
+        self.name = f"Archivo {path}"
+        self._fps = fps
+        self._pacer = None
+        self._cap = None
+
+    def open(self):
+        self._cap = cv2.VideoCapture(self.path)
+        if not self._cap.isOpened():
+            return False
+        # Reproducir al ritmo del archivo para simular una fuente en vivo
+        self._pacer = _Pacer(self._fps or self._cap.get(cv2.CAP_PROP_FPS) or 30)
+        return True
+
+    def is_opened(self):
+        return self._cap is not None and self._cap.isOpened()
+
+    def read(self):
+        self._pacer.wait()
+        ok, frame = self._cap.read()
+        if not ok and self.loop:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._cap.read()
+        self.timestamp = time.monotonic()
+        return ok, frame
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+        self._cap = None
+
+
+class SyntheticSource(FrameSource):
+    """Patrón de prueba en movimiento, para usar el pipeline sin cámara."""
+
+    def __init__(self, width=1280, height=720, fps=30):
+        self.width = width
+        self.height = height
+        self.name = f"Patrón de prueba {width}x{height}"
+        self._pacer = _Pacer(fps)
+        self._background = None
+        self._count = 0
+
+    def open(self):
+        x = np.linspace(0, 255, self.width, dtype=np.uint8)
+        y = np.linspace(0, 255, self.height, dtype=np.uint8)
+        self._background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self._background[:, :, 0] = x[np.newaxis, :]
+        self._background[:, :, 1] = y[:, np.newaxis]
+        self._background[:, :, 2] = 128
+        self._count = 0
+        return True
+
+    def is_opened(self):
+        return self._background is not None
+
+    def read(self):
+        self._pacer.wait()
+        self.timestamp = time.monotonic()
+        frame = self._background.copy()
+        # Una barra que se desplaza y el número de frame, para ver movimiento y detectar saltos
+        bar = self._count * 8 % self.width
+        frame[:, bar:bar + 32] = 255
+        cv2.putText(frame, str(self._count), (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 4)
+        self._count += 1
+        return True, frame
+
+    def close(self):
+        self._background = None
+
+
+def make_source(spec, low_latency=False):
+    """Crea una fuente a partir de un índice de cámara o una descripción de texto.
+
+    Formatos: 0 o "camera:0", "screen[:monitor[:x,y,ancho,alto]][@fps]",
+    "file:ruta.mp4" y "synthetic[:ANCHOxALTO][@fps]". low_latency se aplica
+    a las cámaras (ver CameraSource).
+    """
+    if isinstance(spec, FrameSource):
+        return spec
+    if isinstance(spec, int) or str(spec).isdigit():
+        return CameraSource(int(spec), low_latency)
+    kind, _, rest = str(spec).partition(':')
+    if kind == 'file':
+        return VideoFileSource(rest)
+    rest, _, fps = rest.partition('@')
+    fps = float(fps) if fps else None
+    if kind == 'camera':
+        return CameraSource(int(rest or 0), low_latency)
+    if kind == 'screen':
+        monitor, _, region = rest.partition(':')
+        region = tuple(int(v) for v in region.split(',')) if region else None
+        if region is not None and len(region) != 4:
+            raise ValueError(f"Región de pantalla inválida: {spec}")
+        return ScreenSource(int(monitor or 1), region, fps or 15)
+    if kind == 'synthetic':
+        width, height = (int(v) for v in rest.split('x')) if rest else (1280, 720)
+        return SyntheticSource(width, height, fps or 30)
+    raise ValueError(f"Fuente desconocida: {spec}")
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import devices
+from devices import DeviceRegistry
+
+
+class DeviceRegistrySysfsTest(unittest.TestCase):
+    """Enumeración de cámaras sobre un árbol de sysfs falso."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def add_node(self, node, name, index='0'):
+        path = os.path.join(self.root, node)
+        os.mkdir(path)
+        for field, value in (('name', name), ('index', index)):
+            with open(os.path.join(path, field), 'w') as file:
+                file.write(value + '\n')
+
+    def test_enumera_solo_nodos_de_captura(self):
+        self.add_node('video0', 'Integrated Camera')
+        self.add_node('video1', 'Integrated Camera', index='1')  # Nodo de metadatos de la misma cámara
+        self.add_node('video2', 'USB Camera')
+        os.mkdir(os.path.join(self.root, 'vbi0'))
+        registry = DeviceRegistry(sysfs_root=self.root)
+        self.assertEqual([(device.name, device.index) for device in registry.devices()],
+                         [('Integrated Camera', 0), ('USB Camera', 2)])
+
+    def test_nombres_repetidos_llevan_sufijo(self):
+        self.add_node('video0', 'USB Camera')
+        self.add_node('video2', 'USB Camera')
+        registry = DeviceRegistry(sysfs_root=self.root)
+        names = [device.name for device in registry.devices()]
+        self.assertEqual(names, ['USB Camera', 'USB Camera (2)'])
+        self.assertEqual(len({device.id for device in registry.devices()}), 2)
+
+    def test_refresco_incremental(self):
+        self.add_node('video0', 'Integrated Camera')
+        registry = DeviceRegistry(sysfs_root=self.root)
+        first = registry.devices()
+        notified = []
+        registry.add_listener(notified.append)
+
+        self.add_node('video2', 'USB Camera')
+        with mock.patch.object(registry, '_read_sysfs_node', wraps=registry._read_sysfs_node) as read:
+            self.assertTrue(registry.refresh())
+        read.assert_called_once_with('video2', 2)  # Sólo se leen los metadatos del nodo nuevo
+        self.assertEqual(registry.devices()[0], first[0])
+        self.assertEqual(len(notified), 1)
+
+        self.assertFalse(registry.refresh())
+        self.assertEqual(len(notified), 1)
+
+    def test_no_abre_dispositivos_con_sysfs(self):
+        self.add_node('video0', 'Integrated Camera')
+        with mock.patch.object(devices, '_probe_opencv') as probe:
+            DeviceRegistry(sysfs_root=self.root).devices()
+        probe.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import io
+import unittest
+
+from hub import multipart_boundary, multipart_chunks, read_multipart_part
+
+
+class ReadMultipartPartTest(unittest.TestCase):
+    """Lectura de las partes de un multipart/x-mixed-replace."""
+
+    def test_partes_con_content_length(self):
+        # Los datos pueden contener el boundary: con Content-Length no se busca
+        frames = [b'\xff\xd8uno\r\n--frame\r\n\xff\xd9', b'dos']
+        stream = io.BytesIO(b''.join(b''.join(multipart_chunks(data, 1.5)) for data in frames))
+        headers, data = read_multipart_part(stream)
+        self.assertEqual(data, frames[0])
+        self.assertEqual(headers['x-timestamp'], '1.500000')
+        self.assertEqual(read_multipart_part(stream)[1], frames[1])
+        self.assertIsNone(read_multipart_part(stream))
+
+    def test_partes_sin_content_length_hasta_el_boundary(self):
+        # Como el /video de versiones anteriores de SCam
+        body = b''.join(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + data + b'\r\n'
+                        for data in (b'\xff\xd8uno\nmas\xff\xd9', b'dos', b'tres'))
+        stream = io.BytesIO(body + b'--frame\r\n')
+        parts = [read_multipart_part(stream) for _ in range(3)]
+        self.assertEqual([data for _, data in parts], [b'\xff\xd8uno\nmas\xff\xd9', b'dos', b'tres'])
+        self.assertEqual(parts[2][0]['content-type'], 'image/jpeg')
+
+    def test_corte_a_mitad_de_una_parte(self):
+        header, data, _ = multipart_chunks(b'0123456789')
+        self.assertIsNone(read_multipart_part(io.BytesIO(header + data[:4])))
+        self.assertIsNone(read_multipart_part(io.BytesIO(b'--frame\r\nContent-Type: image/jpeg\r\n\r\nabc')))
+
+    def test_boundary_de_la_cabecera(self):
+        self.assertEqual(multipart_boundary('multipart/x-mixed-replace; boundary=frame'), b'frame')
+        self.assertEqual(multipart_boundary('multipart/x-mixed-replace;boundary="myboundary"'), b'myboundary')
+        self.assertEqual(multipart_boundary(None), b'frame')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from shm_ring import SharedFrameRing
+
+
+class SharedFrameRingTest(unittest.TestCase):
+    """Escritor y lector del anillo de frames en memoria compartida."""
+
+    def setUp(self):
+        self.ring = SharedFrameRing.create(slots=4, slot_size=64)
+        self.reader = SharedFrameRing.attach(self.ring.name, track=True)
+
+    def tearDown(self):
+        self.reader.close()
+        self.ring.close()
+
+    def test_lector_recibe_el_ultimo_frame(self):
+        self.assertIsNone(self.reader.read_latest())
+        self.ring.write(b'uno', 1.0)
+        self.ring.write(b'dos', 2.0)
+        frame = self.reader.read_latest()
+        self.assertEqual((frame.seq, frame.timestamp, frame.data), (2, 2.0, b'dos'))
+        self.assertIsInstance(frame.data, bytes)
+        self.assertIsNone(self.reader.read_latest(frame.seq))
+
+    def test_slot_reutilizado_invalida_la_vista(self):
+        seq = self.ring.write(b'viejo', 1.0)
+        view = self.reader.view(seq)
+        self.assertEqual(bytes(view.data), b'viejo')
+        view.data.release()
+        for index in range(self.ring.slots):
+            self.ring.write(b'nuevo %d' % index)
+        # El escritor dio la vuelta: el slot ya tiene otro frame y el lector lo detecta
+        self.assertFalse(self.reader.valid(seq))
+        self.assertIsNone(self.reader.view(seq))
+        self.assertEqual(self.reader.read_latest(seq).data, b'nuevo 3')
+
+    def test_frame_demasiado_grande_se_descarta(self):
+        self.ring.write(b'chico', 1.0)
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(self.ring.write(b'x' * (self.ring.slot_size + 1)))
+        self.assertEqual(self.reader.last_seq(), 1)
+        self.assertEqual(self.reader.read_latest().data, b'chico')
+
+    def test_otro_lector_ve_la_cabecera(self):
+        self.ring.write(b'uno')
+        other = SharedFrameRing.attach(self.ring.name, track=True)
+        try:
+            self.assertEqual((other.slots, other.slot_size, other.last_seq()), (4, 64, 1))
+        finally:
+            other.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
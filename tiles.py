@@ -0,0 +1,156 @@
+import logging
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from hub import FrameHub
+
+# Formato de los mensajes binarios (little-endian):
+#   cabecera: tipo (0 = keyframe, 1 = delta), ancho, alto, tamaño de tile, cantidad de tiles
+#   por tile: columna, fila, largo del JPEG, JPEG
+MESSAGE_HEADER = struct.Struct('<BHHHH')
+TILE_HEADER = struct.Struct('<HHI')
+KEYFRAME = 0
+DELTA = 1
+
+
+class TileStream:
+    """Codifica sólo los tiles que cambiaron y los publica como mensajes delta.
+
+    Un hilo propio toma los frames crudos del pipeline mientras haya
+    suscriptores, compara cada tile contra el último estado enviado y
+    codifica únicamente los que cambiaron. El último JPEG de cada tile queda
+    en caché, de modo que a un cliente nuevo o atrasado se le arma un
+    keyframe sin volver a codificar nada. Cada keyframe_interval segundos se
+    recodifican todos los tiles para corregir la deriva acumulada.
+    """
+
+    def __init__(self, raw_hub, tile_size=64, quality=50, keyframe_interval=5.0, pixel_threshold=12,
+                 frame_timeout=1.0):
+        self.raw_hub = raw_hub
+        self.tile_size = tile_size
+        self.quality = quality
+        self.keyframe_interval = keyframe_interval
+        self.pixel_threshold = pixel_threshold
+        self.frame_timeout = frame_timeout
+        self.hub = FrameHub()
+        self._lock = threading.Lock()
+        self._tiles = {}  # (columna, fila) -> último JPEG enviado
+        self._size = (0, 0)
+        self._subscribers = 0
+        self._active = threading.Event()
+        self._thread = None
+
+    def subscribe(self):
+        with self._lock:
+            self._subscribers += 1
+            self._active.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tile-stream", daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self):
+        with self._lock:
+            self._subscribers = max(0, self._subscribers - 1)
+            if not self._subscribers:
+                self._active.clear()
+
+    def watched(self):
+        return self._subscribers > 0
+
+    def message_for(self, frame, last_seq):
+        # Un delta sólo sirve si el cliente recibió el mensaje anterior; si no, se le arma un keyframe
+        if last_seq and frame.seq == last_seq + 1:
+            return frame.seq, frame.data
+        return self.keyframe()
+
+    def keyframe(self):
+        with self._lock:
+            latest = self.hub.latest()
+            seq = latest.seq if latest is not None else 0
+            return seq, self._message(KEYFRAME, self._tiles.items())
+
+    def close(self):
+        self._active.set()
+        self.hub.close()
+
+    def _run(self):
+        reference = None
+        last_seq = 0
+        last_keyframe = 0.0
+        while not self.hub.closed:
+            if not self._active.wait(self.frame_timeout):
+                reference = None  # Sin suscriptores: al volver se empieza con un keyframe
+                continue
+            frame = self.raw_hub.wait(last_seq, timeout=self.frame_timeout)
+            if frame is None:
+                if self.raw_hub.closed:
+                    break
+                continue
+            last_seq = frame.seq
+            image = frame.data
+            try:
+                now = time.monotonic()
+                if reference is None or reference.shape != image.shape or now - last_keyframe >= self.keyframe_interval:
+                    reference = image.copy()
+                    changed = self._all_tiles(image)
+                    kind = KEYFRAME
+                    last_keyframe = now
+                else:
+                    changed = self._changed_tiles(image, reference)
+                    kind = DELTA
+                if not changed:
+                    continue
+                tiles = self._encode(image, reference, changed)
+                with self._lock:
+                    if kind == KEYFRAME:
+                        self._tiles = {}
+                        self._size = (image.shape[1], image.shape[0])
+                    self._tiles.update(tiles)
+                    self.hub.publish(self._message(kind, tiles.items()), frame.timestamp)
+            except Exception as e:
+                logging.error(f"Error al codificar tiles: {e}")
+
+    def _all_tiles(self, image):
+        rows, columns = self._grid(image)
+        return [(column, row) for row in range(rows) for column in range(columns)]
+
+    def _changed_tiles(self, image, reference):
+        # Máscara de píxeles cambiados reducida a una grilla de tiles sin recorrer tile por tile en Python
+        diff = cv2.absdiff(image, reference)
+        if diff.ndim == 3:
+            diff = diff.max(axis=2)
+        rows, columns = self._grid(image)
+        size = self.tile_size
+        mask = np.zeros((rows * size, columns * size), dtype=bool)
+        mask[:diff.shape[0], :diff.shape[1]] = diff > self.pixel_threshold
+        grid = mask.reshape(rows, size, columns, size).any(axis=(1, 3))
+        return [(int(column), int(row)) for row, column in zip(*np.nonzero(grid))]
+
+    def _encode(self, image, reference, positions):
+        size = self.tile_size
+        tiles = {}
+        for column, row in positions:
+            y, x = row * size, column * size
+            tile = image[y:y + size, x:x + size]
+            ok, buffer = cv2.imencode('.jpg', tile, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if ok:
+                tiles[(column, row)] = buffer.tobytes()
+                reference[y:y + size, x:x + size] = tile
+        return tiles
+
+    def _grid(self, image):
+        size = self.tile_size
+        return -(-image.shape[0] // size), -(-image.shape[1] // size)
+
+    def _message(self, kind, tiles):
+        tiles = list(tiles)
+        width, height = self._size
+        parts = [MESSAGE_HEADER.pack(kind, width, height, self.tile_size, len(tiles))]
+        for (column, row), data in tiles:
+            parts.append(TILE_HEADER.pack(column, row, len(data)))
+            parts.append(data)
+        return b''.join(parts)